@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 #
 # Retrieve agenda items for my classes for a specified day
-# and send them via email.
+# and send them via email, only if they changed since the
+# previous run.
 #
 # SAMPLE URL:
 # https://web.spaggiari.eu/cvv/app/default/agenda.php?ope=get_events&mode=agenda&tutte_note=0&aula_id=undefined
@@ -9,10 +10,8 @@
 # classe_id=1391771&gruppo_id=&start=2023-10-23&end=2023-10-30
 #
 
+import argparse
 from datetime import *
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-import smtplib
 
 from shared import *
 
@@ -21,6 +20,10 @@ def send_email(to: str, subject: str, text: str, html: str):
     """
     Send an email using the configuration parameters from settings.py.
     """
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    import smtplib
+
     if EMAIL_USE_TLS:
         smtp = smtplib.SMTP_SSL  # type: ignore
     else:
@@ -37,19 +40,58 @@ def send_email(to: str, subject: str, text: str, html: str):
 
 
 if __name__ == "__main__":
-    now = datetime.now()
-    start_date = now.strftime("%Y-%m-%d")
-    #start_date = (now - timedelta(days=14)).strftime("%Y-%m-%d")
-    end_date = (now + timedelta(days=7)).strftime("%Y-%m-%d")
-    cv = ClasseViva(USERNAME, PASSWORD)
-    agenda = []
-    for class_id in [x for x in [s.class_id for s in cv.get_subjects()] + list(EXTRA_CLASS_IDS.keys()) if x]:
-        agenda.extend(cv.get_agenda(start_date, end_date, AUTORE_ID, class_id, EXTRA_CLASS_IDS.get(class_id)))
-    if agenda:
-        subject = f"Agenda dal {start_date} al {end_date}"
-        text = "\n\n".join(str(ai) for ai in sorted(agenda, key=lambda x: x.start))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--start", help="first day, YYYY-MM-DD (default: today)")
+    parser.add_argument("-d", "--days", type=int, default=7, help="days of agenda (default: 7)")
+    parser.add_argument(
+        "-f", "--full", help="download all the days, even if synced recently", action="store_true"
+    )
+    args = parser.parse_args()
+    start = datetime.strptime(args.start or datetime.now().strftime("%Y-%m-%d"), "%Y-%m-%d")
+    end = start + timedelta(days=args.days)
+    start_date = start.strftime("%Y-%m-%d")
+    end_date = end.strftime("%Y-%m-%d")
+
+    # Only the days that weren't synced within AGENDA_SYNC_MAX_AGE are
+    # downloaded, and compared with the local copy of the agenda (with
+    # the default of 20 hours, a daily run downloads the whole window)
+    store = AgendaStore(max_age=0 if args.full else AGENDA_SYNC_MAX_AGE)
+    ranges = store.stale_ranges(AUTORE_ID, start, end)
+    changes: List[Tuple[str, AgendaItem]] = []
+    if ranges:
+        cv = ClasseViva(USERNAME, PASSWORD)
+        class_ids: Dict[str, Optional[str]] = {s.class_id: None for s in cv.get_subjects() if s.class_id}
+        class_ids.update((class_id, desc) for class_id, desc in EXTRA_CLASS_IDS.items() if class_id)
+        for range_start, range_end in ranges:
+            # The requests for all the classes (and weeks) run concurrently
+            agenda = cv.get_agenda_range(range_start, range_end, AUTORE_ID, class_ids)
+            new, changed, removed = store.update(AUTORE_ID, range_start, range_end, agenda)
+            changes.extend(("new", ai) for ai in new)
+            changes.extend(("changed", ai) for ai in changed)
+            changes.extend(("removed", ai) for ai in removed)
+
+    # The email is sent only if something changed, with the changes first
+    if changes:
+        changes.sort(key=lambda change: change[1].start)
+        subject = f"Agenda dal {start_date} al {end_date}: {len(changes)} modifiche"
+        text = "\n\n".join(f"[{change}] {ai}" for change, ai in changes)
+        agenda = store.items(AUTORE_ID, start, end)
+        text += "\n\n" + 50 * "-" + "\n\n" + "\n\n".join(str(ai) for ai in agenda)
         html = """
 <table border="1">
+<thead>
+    <th>Change</th>
+    <th>When</th>
+    <th>Class</th>
+    <th>Author</th>
+    <th>Note</th>
+</thead>
+<tbody>
+""" + "\n".join(ai.html(change) for change, ai in changes) + """
+</tbody>
+</table>
+<br>
+<table border="1">
 <thead>
     <th>When</th>
     <th>Class</th>
@@ -57,8 +99,12 @@ if __name__ == "__main__":
     <th>Note</th>
 </thead>
 <tbody>
-""" + "\n".join(ai.html() for ai in sorted(agenda, key=lambda x: x.start)) + """
+""" + "\n".join(ai.html() for ai in agenda) + """
 </tbody>
 </table>
 """
-        send_email(EMAIL_TO, subject, text, html)
\ No newline at end of file
+        send_email(EMAIL_TO, subject, text, html)
+
+    # The sync is saved only now, so if the email couldn't be sent the
+    # same changes are found (and emailed) again by the next run
+    store.commit()
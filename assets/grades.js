@@ -0,0 +1,112 @@
+// Shared charts of the grades reports (grades.py): each report defines
+// the report object with the subjects, students and grades of its class
+// and the insufficient grades by subject
+function gradePointColor(ctx) {
+    if (ctx.raw > 0 && ctx.raw < 5.5)
+        return 'rgb(255, 99, 132)';
+    else
+        return 'rgb(54, 162, 235)';
+}
+function gradePointRadius(ctx) {
+    if (ctx.raw > 0 && ctx.raw < 5.5)
+        return 8;
+    else
+        return 4;
+}
+function studentDataset(i, color, background) {
+    return {
+        data: report.grades[i],
+        fill: true,
+        backgroundColor: background,
+        borderColor: color,
+        pointBackgroundColor: gradePointColor,
+        pointBorderColor: '#fff',
+        pointHoverBackgroundColor: '#fff',
+        pointHoverBorderColor: color,
+        pointRadius: gradePointRadius
+    };
+}
+function studentChart(i, cssId, compare) {
+    currentStudent = i;
+    let d = {
+        labels: report.subjects,
+        datasets: [studentDataset(i, 'rgb(54, 162, 235)', 'rgba(54, 162, 235, 0.2)')]
+    };
+    if (typeof compare !== "undefined")
+        d.datasets.push(studentDataset(compare, 'rgb(255, 99, 132)', 'rgba(255, 99, 132, 0.2)'));
+    let config = {
+        type: 'radar',
+        data: d,
+        options: {
+            elements: {line: {borderWidth: 3}},
+            plugins: {
+                legend: {display: false}
+            },
+            scales: {
+                r: {
+                    suggestedMin: 0,
+                    suggestedMax: 10
+                }
+            },
+        }
+    };
+    return new Chart(document.getElementById(cssId), config);
+}
+function destroyGradesModalChart() {
+    if (typeof gradesModalChart !== "undefined")
+        gradesModalChart.destroy();
+}
+function compareWith(i) {
+    destroyGradesModalChart();
+    gradesModalChart = studentChart(currentStudent, "gradesModalCanvas", i);
+    document.getElementById("gradesModalCompareLabel").textContent = report.students[i];
+}
+function zoomGrades(i) {
+    destroyGradesModalChart();
+    var gradesModal = new bootstrap.Modal(document.getElementById("gradesModal"), {});
+    gradesModal.show();
+    gradesModalChart = studentChart(i, 'gradesModalCanvas');
+    document.getElementById("gradesModalLabel").textContent = report.students[i];
+    document.getElementById("gradesModalCompareLabel").textContent = "";
+}
+function compareMenu() {
+    let menu = document.getElementById("gradesModalCompare");
+    report.students.forEach(function (name, i) {
+        let a = document.createElement("a");
+        a.className = "dropdown-item";
+        a.href = "#";
+        a.textContent = name;
+        a.onclick = function () { compareWith(i); };
+        let li = document.createElement("li");
+        li.appendChild(a);
+        menu.appendChild(li);
+    });
+}
+function badGradesChart() {
+    new Chart(document.getElementById("bad-grades-by-subject"), {
+        type: 'bar',
+        data: {
+          labels: report.badGrades.subjects,
+          datasets: [
+            {
+              label: "Bad grades",
+              backgroundColor: 'rgb(54, 162, 235)',
+              data: report.badGrades.counts
+            }
+          ]
+        },
+        options: {
+          indexAxis: 'y',
+          plugins: {
+            legend: { display: false },
+            title: { display: false },
+          }
+        }
+    });
+}
+document.addEventListener("DOMContentLoaded", function () {
+    compareMenu();
+    for (let i = 0; i < report.students.length; ++i)
+        studentChart(i, 'student_' + i);
+    badGradesChart();
+});
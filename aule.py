@@ -1,57 +1,485 @@
+import argparse
+from array import array
+from collections import deque
+from collections.abc import Mapping, Sequence
+from contextlib import contextmanager
 from datetime import datetime
+import hashlib
 import os
 import json
-from sys import argv, exit
+import mmap
+import queue
+import re
+import socket
+import struct
+import sys
+from sys import exit
+import threading
 from time import time
+from urllib.parse import parse_qs, urlencode, urlsplit
 
-from pdf2image import convert_from_path
-from pytesseract import image_to_string
+# The PDF, OCR, multiprocessing and HTTP server modules are imported only
+# by the functions that need them, so that the queries start faster
 
 
-def import_pdf(pdf_file):
+# Geometry of the PDF timetable pages
+DPI = 300
+SCALE = DPI / 100
+TOP = (76 * SCALE, 95 * SCALE)
+SIZE = ((255 - 76 + 1) * SCALE, (210 - 95 + 1) * SCALE)
+DAYS = 6
+HOURS = 13
+TOP_ROOM = (128 * SCALE, 46 * SCALE)
+SIZE_ROOM = (170 * SCALE, 14 * SCALE)
+CROPS_PER_PAGE = 1 + DAYS * HOURS
+INK_MARGIN = int(2 * SCALE)  # Pixels ignored near the borders of a cell
+BLANK_THRESHOLD = 0.0002  # Cells with a lower fraction of dark pixels are empty
+PAGE_WINDOW = 2  # Pages rendered at a time
+
+# Header of the binary timetable: magic, version, reserved, days, hours, rooms, strings
+BINARY_HEADER = struct.Struct("<4sHHHHII")
+BINARY_MAGIC = b"AULE"
+BINARY_VERSION = 1
+
+SERVER_PORT = 8642  # Port of the query server on localhost
+SERVER_PATH = "/aule"  # Path of the queries
+SERVER_HEADER = "X-Aule-Server"  # Header of the answers, not sent by other servers
+
+
+def crop_page(image):
     """
-    Import a PDF school class timetable.
+    Crop a timetable page into the room name, followed by the cells
+    of each day, one hour after the other.
     """
+    crops = [image.crop((TOP_ROOM[0], TOP_ROOM[1], TOP_ROOM[0] + SIZE_ROOM[0], TOP_ROOM[1] + SIZE_ROOM[1]))]
+    for day in range(DAYS):
+        for hour in range(HOURS):
+            x1 = TOP[0] + SIZE[0] * day
+            y1 = TOP[1] + SIZE[1] * hour
+            x2 = x1 + SIZE[0]
+            y2 = y1 + SIZE[1]
+            crops.append(image.crop((x1 + 1, y1 + 1, x2 - 1, y2 - 1)))   # Account for the black border
+    return crops
 
-    DPI = 300
-    SCALE = DPI / 100
-    TOP = (76 * SCALE, 95 * SCALE)
-    SIZE = ((255 - 76 + 1) * SCALE, (210 - 95 + 1) * SCALE)
-    DAYS = 6
-    HOURS = 13
-    TOP_ROOM = (128 * SCALE, 46 * SCALE)
-    SIZE_ROOM = (170 * SCALE, 14 * SCALE)
 
-    start = time()
-    print("Importing PDF timetable...")
-    images = convert_from_path(pdf_file, dpi=DPI)
-    end = time()
-    print(f"Timetable imported in {end - start:.1f} seconds.")
+def ink_density(image):
+    """
+    Return the fraction of dark pixels of a cell, ignoring its borders.
+    """
+    width, height = image.size
+    inner = image.crop((INK_MARGIN, INK_MARGIN, width - INK_MARGIN, height - INK_MARGIN))
+    histogram = inner.convert("L").histogram()
+    return sum(histogram[:128]) / max(sum(histogram), 1)
+
+
+def ocr(image):
+    from pytesseract import image_to_string
+
+    return image_to_string(image).strip()
+
+
+def crop_index(x, y):
+    """
+    Return the index (in the same order as crop_page) of the crop that
+    contains the point x, y of a page, or None if it's outside of them.
+    """
+    if TOP_ROOM[0] <= x < TOP_ROOM[0] + SIZE_ROOM[0] and TOP_ROOM[1] <= y < TOP_ROOM[1] + SIZE_ROOM[1]:
+        return 0
+    day = int((x - TOP[0]) // SIZE[0])
+    hour = int((y - TOP[1]) // SIZE[1])
+    if x < TOP[0] or y < TOP[1] or day >= DAYS or hour >= HOURS:
+        return None
+    return 1 + day * HOURS + hour
+
+
+def ocr_page(image):
+    """
+    OCR a whole page at once and assign each word to the crop (see
+    crop_page) that contains its center. Return the texts of the crops,
+    one line per line of text found by tesseract.
+    """
+    from pytesseract import Output, image_to_data
 
+    data = image_to_data(image, output_type=Output.DICT)
+    lines = [{} for _ in range(CROPS_PER_PAGE)]
+    for i, word in enumerate(data["text"]):
+        if not word.strip():
+            continue
+        x = data["left"][i] + data["width"][i] / 2
+        y = data["top"][i] + data["height"][i] / 2
+        index = crop_index(x, y)
+        if index is None:
+            continue
+        line = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines[index].setdefault(line, []).append(word.strip())
+    return ["\n".join(" ".join(words) for words in crop_lines.values()) for crop_lines in lines]
+
+
+def page_timetable(texts):
+    """
+    Convert the OCR'd texts of a page (in the same order as crop_page)
+    into the room name and its list of days, each with its list of hours.
+    """
+    room_str = texts[0]
+    day_list = [texts[1 + day * HOURS:1 + (day + 1) * HOURS] for day in range(DAYS)]
+    return room_str, day_list
+
+
+def image_hash(image):
+    """
+    Return a digest of the pixels of an image, used as OCR cache key.
+    """
+    digest = hashlib.blake2b(f"{image.mode} {image.size}".encode(), digest_size=16)
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def merge_texts(results, known, keys, cache):
+    """
+    Return the text of each item: the known ones (i.e. blank or cached)
+    as they are, the others from the OCR results, in the same order.
+    Every text is saved in the cache under the key of its item.
+    """
+    results = iter(results)
+    for text, key in zip(known, keys):
+        if text is None:
+            text = next(results)
+        if key is not None:
+            cache[key] = text
+        yield text
+
+
+def render_pages(pdf_file, pages, window=PAGE_WINDOW):
+    """
+    Render the pages of a PDF file a few at a time (window pages for
+    each pdftoppm run), so that they are never all in memory at once.
+    """
+    from pdf2image import convert_from_path
+
+    for first in range(1, pages + 1, window):
+        last = min(first + window - 1, pages)
+        for image in convert_from_path(pdf_file, dpi=DPI, first_page=first, last_page=last):
+            yield image
+
+
+def prefetch(iterable, size):
+    """
+    Iterate over iterable in a background thread, staying at most size
+    items ahead of the consumer (e.g. to render the next pages while
+    the current ones are OCR'd).
+    """
+    items = queue.Queue(maxsize=size)
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put((True, item))
+        except BaseException as e:
+            items.put((False, e))
+        items.put((False, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        ok, item = items.get()
+        if not ok:
+            if item is not None:
+                raise item
+            return
+        yield item
+
+
+def prepare_page(image, ocr_mode, blank_threshold, cache):
+    """
+    Return the crops of a page that must be OCR'd (the whole page in
+    the "page" OCR mode), the cache keys of all its crops and their
+    known texts (None if the crop must be OCR'd).
+    """
+    if ocr_mode == "page":
+        keys = ["page " + image_hash(image)]
+        known = [cache.get(keys[0])]
+        return [image] if known[0] is None else [], keys, known
+    crops = crop_page(image)
+    keys = []
+    known = []
+    for i, crop in enumerate(crops):
+        # The room name (the first crop of each page) is always OCR'd
+        if i != 0 and ink_density(crop) < blank_threshold:
+            keys.append(None)
+            known.append("")
+        else:
+            keys.append("cell " + image_hash(crop))
+            known.append(cache.get(keys[-1]))
+    todo = [crop for crop, text in zip(crops, known) if text is None]
+    return todo, keys, known
+
+
+def import_pdf(pdf_file, jobs=1, ocr_mode="cell", blank_threshold=BLANK_THRESHOLD, cache=None):
+    """
+    Import a PDF school class timetable. If jobs is greater than 1,
+    the cells are OCR'd by a pool of as many processes. With the "page"
+    OCR mode each page is OCR'd at once (see ocr_page) instead of cell
+    by cell, which is much faster but can be less accurate. In the
+    "cell" mode, the cells whose fraction of dark pixels is lower than
+    blank_threshold are considered empty and aren't OCR'd at all.
+
+    The cache dictionary maps the hash of the pixels of a cell (or of a
+    page) to its text: only what isn't already there is OCR'd, so that a
+    revised timetable costs only the cells that have actually changed.
+    At the end, the cache contains exactly the texts of this PDF.
+
+    The pages are rendered while the previous ones are OCR'd and only
+    a few of them are in memory at any time, however long the PDF.
+    """
+    from multiprocessing import Pool
+    from pdf2image import pdfinfo_from_path
+
+    if cache is None:
+        cache = {}
     start = time()
-    print("Parsing PDF pages...")
+    print("Importing PDF timetable...")
+    pages = pdfinfo_from_path(pdf_file)["Pages"]
+    print(f"Parsing {pages} PDF pages with {jobs} process{jobs > 1 and 'es' or ''}...")
+    function = ocr_page if ocr_mode == "page" else ocr
+    pool = Pool(jobs) if jobs > 1 else None
+    pending = deque()
+    used_cache = {}
     rooms = {}
-    for i, image in enumerate(images):
-        print("PDF page", i)
-        room_img = image.crop((TOP_ROOM[0], TOP_ROOM[1], TOP_ROOM[0] + SIZE_ROOM[0], TOP_ROOM[1] + SIZE_ROOM[1]))
-        room_str = image_to_string(room_img).strip()
-        day_list = []
-        for day in range(DAYS):
-            hour_list = []
-            for hour in range(HOURS):
-                x1 = TOP[0] + SIZE[0] * day
-                y1 = TOP[1] + SIZE[1] * hour
-                x2 = x1 + SIZE[0]
-                y2 = y1 + SIZE[1]
-                cell = image.crop((x1 + 1, y1 + 1, x2 - 1, y2 - 1))   # Account for the black border
-                cell_str = image_to_string(cell).strip()
-                hour_list.append(cell_str)
-            day_list.append(hour_list)
+    ocr_count = 0
+    crop_count = 0
+    blanks = 0
+
+    def finish_page():
+        keys, known, results = pending.popleft()
+        if pool:
+            results = results.get()
+        texts = list(merge_texts(results, known, keys, used_cache))
+        if ocr_mode == "page":
+            texts = texts[0]
+        room_str, day_list = page_timetable(texts)
         rooms[room_str] = day_list
+        print(f"PDF page {len(rooms)}/{pages}: {room_str}")
+
+    try:
+        for image in prefetch(render_pages(pdf_file, pages), PAGE_WINDOW):
+            todo, keys, known = prepare_page(image, ocr_mode, blank_threshold, cache)
+            ocr_count += len(todo)
+            crop_count += len(keys)
+            blanks += keys.count(None)
+            if pool:
+                results = pool.map_async(function, todo, chunksize=4)
+            else:
+                results = list(map(function, todo))
+            pending.append((keys, known, results))
+            # Keep the pool busy, but don't pile up the crops of every page
+            if len(pending) > jobs:
+                finish_page()
+        while pending:
+            finish_page()
+    finally:
+        if pool:
+            pool.terminate()
+    cache.clear()
+    cache.update(used_cache)
     end = time()
     print(f"Pages parsed in {end - start:.1f} seconds.")
+    unit = ocr_mode == "page" and "pages" or "cells"
+    print(f"{ocr_count} {unit} OCR'd, {crop_count - ocr_count - blanks} {unit} found in the cache.")
+    if blanks:
+        print(f"{blanks} empty cells out of {crop_count - pages} skipped.")
     return rooms
 
+
+def compare_timetables(old, new):
+    """
+    Return the rooms that have been added, removed and changed.
+    """
+    added = sorted(set(new) - set(old))
+    removed = sorted(set(old) - set(new))
+    changed = sorted(room for room in set(old) & set(new) if old[room] != new[room])
+    return added, removed, changed
+
+
+def write_binary_timetable(timetable, path):
+    """
+    Save a timetable in the compact binary format read by BinaryTimetable:
+    after the header, the string index of each room name, the string index
+    of each cell (day by day, hour by hour, room by room, so that all the
+    rooms of a time slot are contiguous), the offset of each string and
+    finally the strings themselves (UTF-8). String 0 is always "".
+    Arrays are unsigned 32 bit integers, little-endian like the header.
+    """
+    strings = {"": 0}
+
+    def string_id(string):
+        return strings.setdefault(string, len(strings))
+
+    rooms = sorted(timetable)
+    days = len(timetable[rooms[0]]) if rooms else DAYS
+    hours = len(timetable[rooms[0]][0]) if rooms else HOURS
+    room_ids = array("I", (string_id(room) for room in rooms))
+    cells = array("I")
+    for day in range(days):
+        for hour in range(hours):
+            cells.extend(string_id(timetable[room][day][hour]) for room in rooms)
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = array("I", [0])
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    if sys.byteorder == "big":
+        for a in (room_ids, cells, offsets):
+            a.byteswap()
+    with open(path + ".tmp", "wb") as f:
+        f.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, days, hours, len(rooms), len(strings)))
+        room_ids.tofile(f)
+        cells.tofile(f)
+        offsets.tofile(f)
+        f.write(b"".join(encoded))
+    os.replace(path + ".tmp", path)
+
+
+class BinaryTimetable(Mapping):
+    """
+    Read-only timetable memory-mapped from the binary format written by
+    write_binary_timetable. It behaves like the dictionary loaded from
+    timetable.json (room -> days -> hours -> text), but nothing is read
+    or decoded until it's accessed, so a query touches only its slice.
+    Close it when done: a mapped file can't be replaced on Windows.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.days, self.hours, rooms, strings = BINARY_HEADER.unpack_from(self._mmap)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError(f"{path} is not a binary timetable")
+        view = memoryview(self._mmap)
+        offset = BINARY_HEADER.size
+
+        def next_array(length):
+            nonlocal offset
+            start = offset
+            offset += length * 4
+            if sys.byteorder == "big":  # The arrays are little-endian
+                swapped = array("I")
+                swapped.frombytes(view[start:offset])
+                swapped.byteswap()
+                return swapped
+            return view[start:offset].cast("I")
+
+        self._room_ids = next_array(rooms)
+        self._cells = next_array(self.days * self.hours * rooms)
+        self._offsets = next_array(strings + 1)
+        self._strings = view[offset:]
+        self._rooms = None
+
+    def close(self):
+        """
+        Release the views on the mapped file and unmap it.
+        """
+        for name in ("_room_ids", "_cells", "_offsets", "_strings"):
+            a = getattr(self, name)
+            if isinstance(a, memoryview):
+                a.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def string(self, i):
+        return str(self._strings[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+
+    def rooms(self):
+        """
+        Return the dictionary of the room names to their indices.
+        """
+        if self._rooms is None:
+            self._rooms = {self.string(room_id): i for i, room_id in enumerate(self._room_ids)}
+        return self._rooms
+
+    def cell(self, room, day, hour):
+        return self.string(self._cells[(day * self.hours + hour) * len(self._room_ids) + room])
+
+    def free_rooms(self, day, hour):
+        """
+        Return the rooms with an empty cell at the specified time slot,
+        reading only the (contiguous) cells of that slot.
+        """
+        rooms = len(self._room_ids)
+        start = (day * self.hours + hour % self.hours) * rooms
+        slot = self._cells[start:start + rooms]
+        return [self.string(self._room_ids[i]) for i, string_id in enumerate(slot) if string_id == 0]
+
+    def __getitem__(self, room):
+        return _BinaryRoom(self, self.rooms()[room])
+
+    def __iter__(self):
+        return iter(self.rooms())
+
+    def __len__(self):
+        return len(self._room_ids)
+
+
+class _BinaryRoom(Sequence):
+    """
+    The days of a room of a BinaryTimetable.
+    """
+
+    def __init__(self, timetable, room):
+        self.timetable = timetable
+        self.room = room
+
+    def __getitem__(self, day):
+        if not -self.timetable.days <= day < self.timetable.days:
+            raise IndexError("day out of range")
+        return _BinaryDay(self.timetable, self.room, day % self.timetable.days)
+
+    def __len__(self):
+        return self.timetable.days
+
+
+class _BinaryDay(Sequence):
+    """
+    The hours of a day of a room of a BinaryTimetable.
+    """
+
+    def __init__(self, timetable, room, day):
+        self.timetable = timetable
+        self.room = room
+        self.day = day
+
+    def __getitem__(self, hour):
+        if not -self.timetable.hours <= hour < self.timetable.hours:
+            raise IndexError("hour out of range")
+        return self.timetable.cell(self.room, self.day, hour % self.timetable.hours)
+
+    def __len__(self):
+        return self.timetable.hours
+
+
+def load_timetable():
+    """
+    Open the binary timetable, converting timetable.json to timetable.bin
+    first if the latter is missing or older than the former. If it can't
+    be replaced because another process (the query server) has it mapped,
+    which happens on Windows, timetable.json is loaded instead.
+    """
+    if not os.path.exists("timetable.bin") or os.path.getmtime("timetable.bin") < os.path.getmtime("timetable.json"):
+        try:
+            convert_json_timetable("timetable.json", "timetable.bin")
+        except PermissionError:
+            with open("timetable.json", "r") as f:
+                return json.load(f)
+    return BinaryTimetable("timetable.bin")
+
+
+def convert_json_timetable(json_file, binary_file):
+    with open(json_file, "r") as f:
+        write_binary_timetable(json.load(f), binary_file)
+
+
 def get_hour(dt):
     """
     Convert a timestamp in a school hour (0 - first, 1 - second, 2 third...)
@@ -72,10 +500,50 @@ def get_hour(dt):
     else:
         return -1
 
+def tokenize(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def build_index(timetable):
+    """
+    Build the query index of a timetable: the sorted list of rooms and
+    the inverted index from each lower case word of the cells (teacher
+    and class names) to its [room, day, hour] list. The free rooms are
+    read straight from the binary timetable, which keeps the cells of a
+    time slot together.
+    """
+    rooms = sorted(timetable)
+    tokens = {}
+    for i, room in enumerate(rooms):
+        for day, hours in enumerate(timetable[room]):
+            for hour, cell in enumerate(hours):
+                for token in set(tokenize(cell)):
+                    tokens.setdefault(token, []).append([i, day, hour])
+    return {"rooms": rooms, "tokens": tokens}
+
+
+def load_index(timetable):
+    """
+    Load the query index saved next to timetable.json, (re)building it
+    if it's missing or older than the timetable.
+    """
+    if os.path.exists("timetable_index.json") and os.path.getmtime("timetable_index.json") >= os.path.getmtime(
+        "timetable.json"
+    ):
+        with open("timetable_index.json", "r") as f:
+            return json.load(f)
+    index = build_index(timetable)
+    with open("timetable_index.json", "w") as f:
+        json.dump(index, f)
+    return index
+
+
 def find_free_room(timetable, day, hour):
     """
     Find a free class on the specified day and time
     """
+    if isinstance(timetable, BinaryTimetable):
+        return timetable.free_rooms(day, hour)
     found = []
     for room, days in timetable.items():
         if "" == days[day][hour]:
@@ -83,59 +551,272 @@ def find_free_room(timetable, day, hour):
     return found
 
 
-def find_matches(timetable, day, hour, text):
+def candidate_cells(index, text):
+    """
+    Return the (room, day, hour) cells that might contain the given text,
+    i.e. those with a word containing each word of the text, or None if
+    the text has no words at all.
+    """
+    candidates = None
+    for word in tokenize(text):
+        cells = set()
+        for token, postings in index["tokens"].items():
+            if word in token:
+                cells.update((index["rooms"][i], day, hour) for i, day, hour in postings)
+        candidates = cells if candidates is None else candidates & cells
+    return candidates
+
+
+def find_matches(timetable, day, hour, text, index=None):
     """
     Find a class whose description contains the given text
     """
     found = []
     now_wday = datetime.now().weekday()
-    for room, days in timetable.items():
-        for h in range(6):
-            if text.lower() in days[day][h].lower():
-                cls = days[day][h].split("\n")[0]
-                if h == hour and day == now_wday:
-                    found.append(f"{h+1} {room} {cls} <---")
-                else:
-                    found.append(f"{h+1} {room} {cls}")
+    candidates = index and candidate_cells(index, text)
+    if candidates is None:
+        cells = [(room, h) for room in timetable for h in range(6)]
+    else:
+        cells = [(room, h) for room, d, h in candidates if d == day and h < 6]
+    for room, h in cells:
+        cell = timetable[room][day][h]
+        if text.lower() in cell.lower():
+            cls = cell.split("\n")[0]
+            if h == hour and day == now_wday:
+                found.append(f"{h+1} {room} {cls} <---")
+            else:
+                found.append(f"{h+1} {room} {cls}")
     return found
 
 
+def answer(timetable, command, day=None, time_str=None, index=None):
+    """
+    Answer a query (a "free" command or a text to look for), optionally
+    on a specific day (1-6) and time (hh:mm), as printed by aule.py.
+    The word index is loaded only if needed and not given.
+    """
+    now = datetime.now()
+    if time_str:
+        user_time = datetime.strptime(time_str, "%H:%M")
+        now = now.replace(hour=user_time.hour, minute=user_time.minute)
+    hour = get_hour(now)
+    if day:
+        day = day - 1
+    else:
+        day = now.weekday()
+    if command == "free":
+        free_rooms = find_free_room(timetable, day, hour)
+        return "\n".join(sorted(free_rooms))
+    if index is None:
+        index = load_index(timetable)
+    matches = find_matches(timetable, day, hour, command, index)
+    if matches:
+        return "\n".join(sorted(matches))
+    return "Not found."
+
+
+class TimetableState:
+    """
+    The timetable and its index kept in memory by the query server,
+    reloaded as soon as timetable.json changes. A binary timetable is
+    unmapped when it's reloaded, so it's replaced only once the requests
+    using it are over (and the new requests wait for the reload).
+    """
+
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.readers = 0
+        self.mtime = None
+        self.timetable = None
+        self.index = None
+        self.reload()
+
+    def reload(self):
+        mtime = os.path.getmtime("timetable.json")
+        # The old binary timetable must be unmapped before it's replaced
+        if isinstance(self.timetable, BinaryTimetable):
+            try:
+                self.timetable.close()
+            except BufferError:
+                pass  # Some view is still alive: the mapping goes with it
+        self.timetable = self.index = None
+        self.timetable = load_timetable()
+        self.index = load_index(self.timetable)
+        self.mtime = mtime
+        print(f"{datetime.now():%Y-%m-%d %H:%M:%S} timetable loaded ({len(self.timetable)} rooms).")
+
+    @contextmanager
+    def current(self):
+        """
+        Provide the timetable and its index, reloading them if needed
+        (both None if the new timetable couldn't be loaded yet): they
+        stay valid until the end of the with block.
+        """
+        with self.lock:
+            if os.path.getmtime("timetable.json") != self.mtime:
+                self.lock.wait_for(lambda: self.readers == 0)
+                if os.path.getmtime("timetable.json") != self.mtime:  # Not reloaded while waiting
+                    try:
+                        self.reload()
+                    except (OSError, ValueError) as e:
+                        print("Timetable not reloaded:", e)  # e.g. still being written
+            self.readers += 1
+            timetable, index = self.timetable, self.index
+        try:
+            yield timetable, index
+        finally:
+            with self.lock:
+                self.readers -= 1
+                self.lock.notify_all()
+
+
+def serve(port=SERVER_PORT):
+    """
+    Run a local HTTP server that keeps the timetable and its index in
+    memory and answers the queries of aule.py (GET /aule?command=...&day=...&time=...).
+    Its answers carry the X-Aule-Server header, so that aule.py can tell
+    them apart from those of any other server listening on the port.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    state = TimetableState()
+
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = parse_qs(url.query)
+            try:
+                if url.path != SERVER_PATH:
+                    raise KeyError(url.path)
+                command = query["command"][0]
+                day = int(query["day"][0]) if "day" in query else None
+                time_str = query["time"][0] if "time" in query else None
+                with state.current() as (timetable, index):
+                    if timetable is None:
+                        body = "The timetable is being updated, try again."
+                        status = 503
+                    else:
+                        body = answer(timetable, command, day, time_str, index)
+                        status = 200
+            except (KeyError, ValueError, IndexError) as e:
+                body = f"Bad query: {e}"
+                status = 400
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header(SERVER_HEADER, "1")
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), QueryHandler)
+    print(f"Answering the queries on http://127.0.0.1:{port}{SERVER_PATH} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def query_server(command, day=None, time_str=None, port=SERVER_PORT):
+    """
+    Ask a running query server, returning None if there isn't any (or
+    if what answers on the port isn't a query server).
+    A plain socket is enough for such a request and much faster to
+    import than an HTTP client.
+    """
+    params = {"command": command}
+    if day:
+        params["day"] = day
+    if time_str:
+        params["time"] = time_str
+    request = f"GET {SERVER_PATH}?{urlencode(params)} HTTP/1.0\r\nHost: 127.0.0.1:{port}\r\n\r\n"
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=10) as connection:
+            connection.sendall(request.encode("ascii"))
+            chunks = []
+            while True:
+                chunk = connection.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+    except OSError:
+        return None
+    head, _, body = b"".join(chunks).partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+    headers = {line.partition(":")[0].strip().lower() for line in header_lines}
+    if status_line.split(" ", 2)[1:2] != ["200"] or SERVER_HEADER.lower() not in headers:
+        return None
+    return body.decode("utf-8")
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("command", nargs="?")
+    parser.add_argument("day", nargs="?", type=int)
+    parser.add_argument("time", nargs="?")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("-o", "--ocr", choices=["cell", "page"], default="cell")
+    parser.add_argument("-b", "--blank-threshold", type=float, default=BLANK_THRESHOLD)
+    parser.add_argument("-i", "--import-pdf")
+    parser.add_argument("-s", "--serve", action="store_true")
+    parser.add_argument("-p", "--port", type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+    if args.import_pdf:
+        args.import_pdf = os.path.abspath(args.import_pdf)
     os.chdir(os.path.abspath(os.path.dirname(__file__)))
-    if not os.path.exists("timetable.json"):
-        print("timetable.json doesn't exist, it must be created from scratch.")
-        pdf_file = input("PDF FILE: ")
-        timetable = import_pdf(pdf_file)
+    if args.import_pdf or not os.path.exists("timetable.json"):
+        if args.import_pdf:
+            pdf_file = args.import_pdf
+        else:
+            print("timetable.json doesn't exist, it must be created from scratch.")
+            pdf_file = input("PDF FILE: ")
+        old_timetable = None
+        if os.path.exists("timetable.json"):
+            with open("timetable.json", "r") as f:
+                old_timetable = json.load(f)
+        ocr_cache = {}
+        if os.path.exists("ocr_cache.json"):
+            with open("ocr_cache.json", "r") as f:
+                ocr_cache = json.load(f)
+        timetable = import_pdf(pdf_file, args.jobs, args.ocr, args.blank_threshold, ocr_cache)
+        # timetable.bin is converted on the next load (by the query server
+        # too, which must unmap the old one first on Windows)
         with open("timetable.json", "w") as f:
             json.dump(timetable, f)
+        with open("ocr_cache.json", "w") as f:
+            json.dump(ocr_cache, f)
+        if old_timetable is not None:
+            added, removed, changed = compare_timetables(old_timetable, timetable)
+            print("Added rooms:", ", ".join(added) or "none")
+            print("Removed rooms:", ", ".join(removed) or "none")
+            print("Changed rooms:", ", ".join(changed) or "none")
     else:
         print("timetable.json found.")
-        with open("timetable.json", "r") as f:
-            timetable = json.load(f)
-    
-    if len(argv) == 1:
-        print("Usage: aule.py <COMMAND>")
+        if args.command and not args.serve:
+            output = query_server(args.command, args.day, args.time, args.port)
+            if output is not None:
+                print(output)
+                exit(0)
+        if not args.serve:
+            timetable = load_timetable()
+
+    if args.serve:
+        serve(args.port)
+        exit(0)
+
+    if not args.command:
+        print("Usage: aule.py [-i PDF_FILE] [-j JOBS] [-o cell|page] [-b BLANK_THRESHOLD] [-p PORT] <COMMAND>")
+        print("       aule.py [-p PORT] --serve")
         print('\n   COMMAND: <"some prof. name"> [day 1-6]')
-        print('   COMMAND: free [day 1-6] [hh:mm]\n')
+        print('   COMMAND: free [day 1-6] [hh:mm]')
+        print("\n   PDF_FILE: import a new (or revised) PDF timetable, OCR'ing only the changed cells")
+        print("   JOBS: number of OCR processes when importing the PDF (default: all the CPUs)")
+        print("   -o: OCR each cell on its own (default) or each page at once")
+        print(f"   BLANK_THRESHOLD: fraction of dark pixels below which a cell is empty (default: {BLANK_THRESHOLD})")
+        print(f"   --serve: keep the timetable in memory and answer the queries on PORT (default: {SERVER_PORT})\n")
         exit(1)
     
-    command = argv[1]
-    now = datetime.now()
-    if len(argv) == 4:
-        user_time = datetime.strptime(argv[3], "%H:%M")
-        now = now.replace(hour=user_time.hour, minute=user_time.minute)
-    hour = get_hour(now)
-    if len(argv) == 3:
-        day = int(argv[2]) - 1
-    else:
-        day = now.weekday()
-    if command == "free":
-        free_rooms = find_free_room(timetable, day, hour)
-        print("\n".join(sorted(free_rooms)))
-    else:
-        text = argv[1]
-        matches = find_matches(timetable, day, hour, text)
-        if matches:
-            print("\n".join(sorted(matches)))
-        else:
-            print("Not found.")
+    print(answer(timetable, args.command, args.day, args.time))
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# Benchmarks of the slower parts of the tools
+#
+
+import argparse
+from difflib import SequenceMatcher
+from multiprocessing import Pool
+import os
+import subprocess
+import sys
+import tempfile
+from time import time
+
+
+def run(function, items, jobs):
+    if jobs > 1:
+        with Pool(jobs) as pool:
+            return pool.map(function, items)
+    return list(map(function, items))
+
+
+def bench_ocr(args):
+    """
+    Compare the timetable import with one tesseract call per cell and
+    with one tesseract call per page: wall time and cell-level accuracy,
+    taking the per-cell OCR as the reference.
+    """
+    from pdf2image import convert_from_path
+    import aule
+
+    images = convert_from_path(args.pdf_file, dpi=aule.DPI, last_page=args.pages)
+    print(f"{len(images)} pages, {aule.CROPS_PER_PAGE} crops per page, {args.jobs} jobs")
+
+    start = time()
+    crops = [crop for image in images for crop in aule.crop_page(image)]
+    cell_texts = run(aule.ocr, crops, args.jobs)
+    cell_time = time() - start
+    print(f"Cell by cell: {cell_time:.1f} seconds, {len(crops)} tesseract calls")
+
+    start = time()
+    page_texts = [text for texts in run(aule.ocr_page, images, args.jobs) for text in texts]
+    page_time = time() - start
+    print(f"Page at once: {page_time:.1f} seconds, {len(images)} tesseract calls")
+
+    same = 0
+    similarity = 0.0
+    for cell_text, page_text in zip(cell_texts, page_texts):
+        a = " ".join(cell_text.split())
+        b = " ".join(page_text.split())
+        same += a == b
+        similarity += SequenceMatcher(None, a, b).ratio()
+        if args.verbose and a != b:
+            print(f"   {a!r} != {b!r}")
+    print(f"Speedup: {cell_time / page_time:.1f}x")
+    print(f"Identical cells: {same}/{len(cell_texts)} ({same * 100 / len(cell_texts):.1f}%)")
+    print(f"Average similarity: {similarity * 100 / len(cell_texts):.1f}%")
+
+
+def bench_startup(args):
+    """
+    Compare the time needed to load the timetable and answer a "free"
+    query from timetable.json and from its binary, memory-mapped version.
+    """
+    import json
+    import aule
+
+    with tempfile.TemporaryDirectory() as tmp:
+        binary_file = os.path.join(tmp, "timetable.bin")
+        aule.convert_json_timetable(args.timetable, binary_file)
+        print(f"timetable.json: {os.path.getsize(args.timetable)} bytes")
+        print(f"timetable.bin: {os.path.getsize(binary_file)} bytes")
+
+        start = time()
+        for _ in range(args.repeat):
+            with open(args.timetable, "r") as f:
+                json_rooms = aule.find_free_room(json.load(f), 0, 0)
+        json_time = (time() - start) / args.repeat
+
+        start = time()
+        for _ in range(args.repeat):
+            with aule.BinaryTimetable(binary_file) as timetable:
+                binary_rooms = aule.find_free_room(timetable, 0, 0)
+        binary_time = (time() - start) / args.repeat
+
+    assert sorted(json_rooms) == sorted(binary_rooms)
+    print(f"JSON load and query: {json_time * 1000:.2f} ms")
+    print(f"Binary load and query: {binary_time * 1000:.2f} ms")
+    print(f"Speedup: {json_time / binary_time:.1f}x")
+
+
+TOOLS = ["agenda", "aule", "competence_levels", "find_student", "grades", "student_list"]
+
+
+def bench_imports(args):
+    """
+    Measure the import time of each tool with python -X importtime (in
+    a new interpreter, so nothing is cached) and report the heaviest
+    modules. The exit code is 1 if a tool takes more than --max-ms.
+    """
+    tools_dir = os.path.abspath(os.path.dirname(__file__))
+    failed = []
+    for tool in args.tools or TOOLS:
+        res = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {tool}"],
+            cwd=tools_dir,
+            capture_output=True,
+            text=True,
+        )
+        if res.returncode != 0:
+            print(f"{tool}: import failed\n{res.stderr.splitlines()[-1]}")
+            failed.append(tool)
+            continue
+        # import time: self [us] | cumulative | imported package
+        # The modules are listed after their own imports, so the tool's
+        # subtree is what comes after the previous top level module
+        startup = 0
+        modules = []
+        for line in res.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            name = name[1:].rstrip()
+            if name.startswith(" "):
+                modules.append((int(cumulative), name.strip()))
+            elif name == tool:
+                tool_time = int(cumulative)
+                break
+            else:
+                startup += int(cumulative)
+                modules = []
+        print(f"{tool}: {tool_time / 1000:.1f} ms (interpreter startup: {startup / 1000:.1f} ms)")
+        for cumulative, name in sorted(modules, reverse=True)[: args.top]:
+            print(f"   {cumulative / 1000:8.1f} ms {name}")
+        if args.max_ms and tool_time / 1000 > args.max_ms:
+            failed.append(tool)
+    if failed:
+        print("Too slow or failed:", ", ".join(failed))
+        exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-v", "--verbose", help="increase output verbosity", action="store_true"
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    ocr_parser = subparsers.add_parser("ocr", help="timetable OCR, per cell vs per page")
+    ocr_parser.add_argument("pdf_file")
+    ocr_parser.add_argument("-p", "--pages", type=int, help="benchmark only the first pages")
+    ocr_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    ocr_parser.set_defaults(function=bench_ocr)
+    startup_parser = subparsers.add_parser("startup", help="timetable loading, JSON vs binary")
+    startup_parser.add_argument("timetable", nargs="?", default="timetable.json")
+    startup_parser.add_argument("-r", "--repeat", type=int, default=100)
+    startup_parser.set_defaults(function=bench_startup)
+    imports_parser = subparsers.add_parser("imports", help="import time of the tools")
+    imports_parser.add_argument("tools", nargs="*", help=f"default: {' '.join(TOOLS)}")
+    imports_parser.add_argument("-t", "--top", type=int, default=5, help="heaviest modules shown")
+    imports_parser.add_argument("-m", "--max-ms", type=float, help="maximum import time of a tool")
+    imports_parser.set_defaults(function=bench_imports)
+    args = parser.parse_args()
+    args.function(args)
@@ -14,11 +14,49 @@ import os
 from sys import argv, exit
 import webbrowser
 
-from fpdf import FPDF  # type: ignore
-
 from shared import *
 
 
+def new_competencies() -> List[CompetenceLevel]:
+    return CompetenceLevel.from_bounds(
+        [
+            ("Competenza non sufficiente (<= 4)", 4),
+            ("Competenza base (5, 6)", 6),
+            ("Competenza intermedia (7, 8)", 8),
+            ("Competenza avanzata (9, 10)", None),
+        ]
+    )
+
+
+def fetch_tests(cv: ClasseViva, subject: Subject, term_index: int) -> List[StudentGrades]:
+    students = cv.get_students(subject)
+    return cv.get_tests(subject, students, term_index)
+
+
+def write_pdf(path: str, title: str, competencies: List[str], grades: List[str]):
+    """
+    Save the PDF report of a subject on a class. It runs in a worker
+    process, so it only gets strings: the competence levels and the
+    individual grades, already formatted.
+    """
+    from fpdf import FPDF  # type: ignore
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=18)
+    pdf.cell(200, 10, txt=f"Risultati test di ingresso", ln=1, align="L")
+    pdf.set_font("Arial", size=14)
+    pdf.cell(200, 20, txt=title, ln=1, align="L")
+    for c in competencies:
+        pdf.cell(200, 10, txt=c, ln=1, align="L")
+    pdf.set_font("Arial", size=18)
+    pdf.cell(200, 20, txt=f"Valutazioni individuali", ln=1, align="L")
+    pdf.set_font("Arial", size=14)
+    for g in grades:
+        pdf.cell(200, 10, txt=g, ln=1, align="L")
+    pdf.output(path)
+
+
 if __name__ == "__main__":
     try:
         term_index = int(argv[1])
@@ -32,23 +70,49 @@ if __name__ == "__main__":
     out_dir = os.path.join(os.getcwd(), "reports")
     if not os.path.exists(out_dir):
         os.makedirs(out_dir)
+
+    # The students and tests of every subject are fetched concurrently,
+    # the competence levels are computed as soon as they arrive and the
+    # PDF files are rendered by a pool of processes in the meantime (they
+    # are spawned, not forked: a fork would copy the session in the middle
+    # of the requests of the fetching threads)
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    results = {}
+    with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as pdf_pool:
+        pdf_jobs = []
+        for subject, grades in cv.fetch_concurrently(
+            lambda s: fetch_tests(cv, s, term_index), subjects
+        ):
+            table = cv.compute_competence_levels_batch(new_competencies(), grades)
+            competencies = table.levels(test_index)
+            if competencies is None:  # There are no tests for this class, at this index in this term
+                continue
+            missing = table.missing[test_index]
+            results[subject] = (competencies, missing)
+            pdf_jobs.append(
+                pdf_pool.submit(
+                    write_pdf,
+                    os.path.join(out_dir, f"{subject.subject} - {subject.class_}.pdf"),
+                    f"{subject.class_} - {subject.subject}",
+                    [f"{c.name} = {c.perc}%" for c in competencies],
+                    [f"{g.student.name}  {g.grades[test_index] or '-'}" for g in grades],
+                )
+            )
+        for job in pdf_jobs:
+            job.result()
+
+    # The screen and HTML output follow the order of the subjects
     html_file = os.path.join(out_dir, "out.html")
     with open(html_file, "w") as f:
         f.write("<style>td,th{border:1px solid black}</style>")
         f.write("<h1>Competence levels</h1>")
         for subject in subjects:
             f.write(f"<h2>{subject}</h2>")
-            students = cv.get_students(subject)
-            grades = cv.get_tests(subject, students, term_index)
-            competencies = [
-                CompetenceLevel("Competenza non sufficiente (<= 4)", lambda x: x <= 4),
-                CompetenceLevel("Competenza base (5, 6)", lambda x: x > 4 and x <= 6),
-                CompetenceLevel("Competenza intermedia (7, 8)", lambda x: x > 6 and x <= 8),
-                CompetenceLevel("Competenza avanzata (9, 10)", lambda x: x > 8),
-            ]
-            missing = cv.compute_competence_levels(competencies, grades, test_index)
-            if missing is None:  # There are no tests for this class, at this index in this term
+            if subject not in results:
                 continue
+            competencies, missing = results[subject]
 
             # Output the result to the screen
             print(subject.class_, "\n")
@@ -66,23 +130,6 @@ if __name__ == "__main__":
                 f.write(f"<td>{c.perc}%</td>")
             f.write("</tr></table>")
             f.write(f"<strong>Missing students ({len(missing)}):</strong> " + ", ".join(s.name for s in missing))
-
-            # Output the result to a PDF file
-            pdf = FPDF()
-            pdf.add_page()
-            pdf.set_font("Arial", size=18)
-            pdf.cell(200, 10, txt=f"Risultati test di ingresso", ln=1, align="L")
-            pdf.set_font("Arial", size=14)
-            pdf.cell(200, 20, txt=f"{subject.class_} - {subject.subject}", ln=1, align="L")
-            for c in competencies:
-                pdf.cell(200, 10, txt=f"{c.name} = {c.perc}%", ln=1, align="L")
-            pdf.set_font("Arial", size=18)
-            pdf.cell(200, 20, txt=f"Valutazioni individuali", ln=1, align="L")
-            pdf.set_font("Arial", size=14)
-            for g in grades:
-                grade = g.grades[test_index] or "-"
-                pdf.cell(200, 10, txt=f"{g.student.name}  {grade}", ln=1, align="L")
-            pdf.output(os.path.join(out_dir, f"{subject.subject} - {subject.class_}.pdf"))
         print(f"The competence levels have also been saved in HTML and PDF format in the {out_dir} directory")
 
     webbrowser.open(f"file://{html_file}")
@@ -14,13 +14,38 @@ if __name__ == "__main__":
     parser.add_argument(
         "-v", "--verbose", help="increase output verbosity", action="store_true"
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help=f"number of classes fetched in parallel (default: {MAX_WORKERS})",
+        type=int,
+        default=MAX_WORKERS,
+    )
+    parser.add_argument(
+        "-r",
+        "--refresh",
+        help="crawl every class again instead of using the local index",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-p",
+        "--prefix",
+        help="match only the beginning of the first or last names",
+        action="store_true",
+    )
     args = parser.parse_args()
-    partial_name = args.name.upper()
-    cv = ClasseViva(USERNAME, PASSWORD)
-    classes = cv.get_all_classes()
-    for c in classes:
-        print(c.name)
-        students = cv.get_students_by_class(c)
-        for s in students:
-            if partial_name in s.name:
-                print(f"   --->   {s}")
+    index = StudentIndex()
+    # The network is used only if the index is missing, too old or
+    # explicitly refreshed: otherwise the search is entirely local
+    if args.refresh or index.is_stale():
+        cv = ClasseViva(USERNAME, PASSWORD, max_workers=args.workers)
+        updated = index.refresh(cv, force=args.refresh)
+        if args.verbose:
+            print(f"Updated {len(updated)} classes:", " ".join(c.name for c in updated))
+            print(cv.cache)
+    last_class = None
+    for class_name, s in index.search(args.name, prefix=args.prefix):
+        if class_name != last_class:
+            print(class_name)
+            last_class = class_name
+        print(f"   --->   {s}")
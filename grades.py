@@ -1,48 +1,37 @@
 # -*- coding: utf-8 -*-
 #
 # Shows the grades for the students of the specified class
+# (or of all the classes of the coordinator, with --all).
+# Each run saves a snapshot of the grades, which --trend
+# compares to the older snapshots and terms to find the
+# drops of the students' averages without scraping again.
 #
 
 import argparse
+import html
+import json
 import os
+import shutil
+from string import Template
 from sys import exit
+from typing import TextIO
 
 from shared import *
 
+ASSETS = ["grades.css", "grades.js"]
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+COLS_PER_ROW = 3
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("section")
-    parser.add_argument("term")
-    args = parser.parse_args()
-    class_ = args.section
-    term = args.term
-    cv = ClasseViva(USERNAME, PASSWORD)
-    classes = [c for c in cv.get_classes() if c.name == class_]
-    if not classes:
-        print("Section not found:", class_)
-        exit(1)
-    c = classes[0]
-    student_grades = cv.get_avg_grades(c, term)
-    bad_grades_by_subject = {}
-    for sg in student_grades:
-        bg = sg.bad_grades(subject_only=True)
-        for subject in bg[1]:
-            if subject in bad_grades_by_subject:
-                bad_grades_by_subject[subject] += 1
-            else:
-                bad_grades_by_subject[subject] = 1
-    bad_grades_by_subject = dict(reversed(sorted(bad_grades_by_subject.items(), key=lambda item: item[1])))
-    if not os.path.exists("reports"):
-        os.mkdir("reports")
-    outfile = os.path.join("reports", "grades_" + class_ + ".html")
-    with open(outfile, "w") as f:
-        f.write(f"""<!DOCTYPE html>
+# The templates are compiled once, the report is streamed into the file:
+# the header, one card per student and the data of the charts as JSON,
+# which the shared assets/grades.js turns into charts
+HEADER = Template(
+    """<!DOCTYPE html>
 <html>
   <head>
     <meta charset="utf-8">
     <meta name="viewport" content="width=device-width, initial-scale=1">
-    <title>{class_} grade charts</title>
+    <title>$class_ grade charts</title>
     <!-- http://meyerweb.com/eric/tools/css/reset/ -->
     <link rel="stylesheet" href="css/reset/reset.css">
     <!--[if lt IE 9]>
@@ -50,21 +39,14 @@ if __name__ == "__main__":
     <![endif]-->
     <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.2.2/dist/css/bootstrap.min.css" rel="stylesheet" integrity="sha384-Zenh87qX5JnK2Jl0vWa8Ck2rdkQ2Bzep5IDxbcnCeuOxjzrPF/et3URy9Bv1WTRi" crossorigin="anonymous">
     <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.9.1/font/bootstrap-icons.css">
-    <style>
-    h1 {{
-        margin-top: 1em;
-    }}
-    .card {{
-        margin-top: 1em;
-    }}
-    </style>
+    <link rel="stylesheet" href="assets/grades.css">
   </head>
-  <body> 
+  <body>
 <nav class="navbar navbar-expand-lg navbar-dark bg-primary">
   <div class="container">
     <a class="navbar-brand" href="#">
         <img alt="Logo" width="28" height="33" class="d-inline-block align-text-top" src="https://www.bernardi.cloud/school/cc.png">
-        {class_} GRADE CHARTS
+        $class_ GRADE CHARTS
     </a>
   </div>
 </nav>
@@ -74,63 +56,31 @@ if __name__ == "__main__":
         <canvas id="bad-grades-by-subject"></canvas>
     </div>
     <h1>Student performance</h1>
-""")
-        COLS_PER_ROW = 3
-        students = []
-        for i, sg in enumerate(student_grades):
-            students.append(f"{i+1}. {sg.student.name.upper()}")
-            if (i % COLS_PER_ROW) == 0:
-                f.write(f'<div class="row row-cols-md-1 row-cols-lg-{COLS_PER_ROW} g-4">')
-            css_border = ""
-            css_text = ""
-            avg = sg.avg()
-            if avg is None:
-                avg_str = ""
-            else:
-                avg_str = f"{avg:.1f}"
-            bad_str = ""
-            bad_grades, bad_subjects = sg.bad_grades(4, 5.5)
-            bad_subjects = [bs.replace(" ", "&nbsp;") for bs in bad_subjects]
-            if bad_grades is not None and bad_grades > 0:
-                css_border = " border-danger"
-                css_text = " text-danger"
-                bad_str += f"<br>{bad_grades} insufficient grade{bad_grades > 1 and 's' or ''}: {', '.join(bad_subjects)}"
-            very_bad_grades, very_bad_subjects = sg.bad_grades(-1, 4)
-            very_bad_subjects = [vbs.replace(" ", "&nbsp;") for vbs in very_bad_subjects]
-            if very_bad_grades is not None and very_bad_grades > 0:
-                css_border = " border-danger"
-                css_text = " text-danger"
-                bad_str += f"<br>{very_bad_grades} very bad grade{very_bad_grades > 1 and 's' or ''}: {', '.join(very_bad_subjects)}"
-            if avg >= 8:
-                css_border = " border-success"
-                css_text = " text-success"
-            f.write(f"""
-<div class="col">
-    <div class="card{css_border}{css_text}">
-        <div class="card-header{css_border}{css_text}">
-            {i+1}. {sg.student.name.upper()}
-            <i class="bi bi-zoom-in" onclick="zoomGrades({i}, '{i+1}. {sg.student.name.upper()}')"></i>
+"""
+)
+ROW_START = Template('<div class="row row-cols-md-1 row-cols-lg-$cols g-4">\n')
+CARD = Template(
+    """<div class="col">
+    <div class="card$css">
+        <div class="card-header$css">
+            $name
+            <i class="bi bi-zoom-in" onclick="zoomGrades($i)"></i>
         </div>
-        <div class="card-body{css_border}{css_text}"><canvas id="student_{i}"></canvas></div>
-        <div class="card-footer{css_border}{css_text}">
-        Average: {avg_str}{bad_str} 
+        <div class="card-body$css"><canvas id="student_$i"></canvas></div>
+        <div class="card-footer$css">
+        Average: $avg$bad
         </div>
     </div>
 </div>
-""")
-            if (i % COLS_PER_ROW) == (COLS_PER_ROW - 1):
-                f.write("</div>")
-        # Close the last row, if needed
-        if ((len(student_grades) - 1) % COLS_PER_ROW) != (COLS_PER_ROW - 1):
-            f.write("</div>")
-        students_js = "[" + ",".join(f'"{x}"' for x in students) + "]";
-        f.write("""
-</div> <!-- .container -->
+"""
+)
+FOOTER = Template(
+    """</div> <!-- .container -->
 <div class="modal fade" id="gradesModal" tabindex="-1" aria-labelledby="gradesModalLabel" aria-hidden="true">
   <div class="modal-dialog">
     <div class="modal-content">
       <div class="modal-header">
-        <h1 class="modal-title fs-5" id="gradesModalLabel">Modal title</h1>
+        <h1 class="modal-title fs-5" id="gradesModalLabel"></h1>
         <button type="button" class="btn-close" data-bs-dismiss="modal" aria-label="Close"></button>
       </div>
       <div class="modal-body">
@@ -138,9 +88,7 @@ if __name__ == "__main__":
         <button class="btn btn-secondary dropdown-toggle" type="button" data-bs-toggle="dropdown" aria-expanded="false">
         Compare with...
         </button>&nbsp;&nbsp;&nbsp;<span id="gradesModalCompareLabel"></span>
-        <ul class="dropdown-menu">""" +
-        "\n".join(f'''<li><a class="dropdown-item" href="#" onclick="compareWith({i}, '{x}')">{x}</a></li>''' for i, x in enumerate(students)) +
-        """</ul></div>
+        <ul class="dropdown-menu" id="gradesModalCompare"></ul></div>
         <canvas id="gradesModalCanvas"></canvas>
       </div>
       <div class="modal-footer">
@@ -152,114 +100,304 @@ if __name__ == "__main__":
 
 <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.2.2/dist/js/bootstrap.bundle.min.js" integrity="sha384-OERcA2EqjJCMA+/3y+gxIOqMEjwtxJY7qPCqsdltbNJuaOe923+mo//f6V8Qbsw3" crossorigin="anonymous"></script>
 <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-<script>
-let students = """ + students_js + """
-function gradePointColor(ctx) {
-    if (ctx.raw > 0 && ctx.raw < 5.5)
-        return 'rgb(255, 99, 132)';
-    else
-        return 'rgb(54, 162, 235)';
-}
-function gradePointRadius(ctx) {
-    if (ctx.raw > 0 && ctx.raw < 5.5)
-        return 8;
-    else
-        return 4;
-}
-function studentChart(i, cssId, compare) {
-    currentStudent = i;
-    let d = JSON.parse(JSON.stringify(data[i])); // deep copy
-    d.datasets[0]["pointBackgroundColor"] = gradePointColor;
-    d.datasets[0]["pointRadius"] = gradePointRadius;
-    if (typeof compare !== "undefined") {
-        let newd = JSON.parse(JSON.stringify(data[compare].datasets[0])); // deep copy
-        newd["pointBackgroundColor"] = gradePointColor;
-        newd["pointRadius"] = gradePointRadius;
-        newd["backgroundColor"] = 'rgba(255, 99, 132, 0.2)';
-        newd["borderColor"] = 'rgb(255, 99, 132)';
-        newd["pointHoverBorderColor"] = 'rgb(255, 99, 132)';
-        d.datasets.push(newd);
-    }
-    let config = {
-        type: 'radar',
-        data: d,
-        options: {
-            elements: {line: {borderWidth: 3}},
-            plugins: {
-                legend: {display: false}
-            },
-            scales: {
-                r: {
-                    suggestedMin: 0,
-                    suggestedMax: 10
-                }
-            },
-        }
-    };
-    return new Chart(document.getElementById(cssId), config);
-}
-function destroyGradesModalChart() {
-    if (typeof gradesModalChart !== "undefined")
-        gradesModalChart.destroy();
-}
-function compareWith(i, name) {
-    destroyGradesModalChart();
-    gradesModalChart = studentChart(currentStudent, "gradesModalCanvas", i);
-    let gradesModalCompareLabel = document.getElementById("gradesModalCompareLabel");
-    gradesModalCompareLabel.innerHTML = name;
-}
-function zoomGrades(i, title) {
-    destroyGradesModalChart();
-    var gradesModal = new bootstrap.Modal(document.getElementById("gradesModal"), {});
-    gradesModal.show();
-    gradesModalChart = studentChart(i, 'gradesModalCanvas');
-    let gradesModalLabel = document.getElementById("gradesModalLabel");
-    gradesModalLabel.innerHTML = title;
-}
-let data = [];
-""")
-        for i, sg in enumerate(student_grades):
-            labels = ['"' + g.sanitized_subject() + '"' for g in sg.grades]
-            scores = [f"{g.grade and g.grade or 0}" for g in sg.grades]
-            f.write("""
-data.push({
-    labels: [""" + ",".join(labels) + """],
-    datasets: [{
-        data: [""" + ",".join(scores) + """],
-        fill: true,
-        backgroundColor: 'rgba(54, 162, 235, 0.2)',
-        borderColor: 'rgb(54, 162, 235)',
-        pointBackgroundColor: gradePointColor,
-        pointBorderColor: '#fff',
-        pointHoverBackgroundColor: '#fff',
-        pointHoverBorderColor: 'rgb(54, 162, 235)',
-        pointRadius: gradePointRadius
-    }]
-})
-""")
-        f.write("""
-for (let i = 0; i < data.length; ++i) (function () {
-    studentChart(i, 'student_' + i);
-})();
-new Chart(document.getElementById("bad-grades-by-subject"), {
-    type: 'bar',
-    data: {
-      labels: [""" + ",".join(f'"{x}"' for x in bad_grades_by_subject.keys()) + """],
-      datasets: [
-        {
-          label: "Bad grades",
-          backgroundColor: 'rgb(54, 162, 235)',
-          data: [""" + ",".join(str(x) for x in bad_grades_by_subject.values()) + """]
-        }
-      ]
-    },
-    options: {
-      indexAxis: 'y',
-      plugins: {
-        legend: { display: false },
-        title: { display: false },
-      }
+<script>const report = $data;</script>
+<script src="assets/grades.js"></script>
+</body></html>
+"""
+)
+INDEX_HEADER = Template(
+    """<!DOCTYPE html>
+<html>
+  <head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <title>Grade charts, term $term</title>
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.2.2/dist/css/bootstrap.min.css" rel="stylesheet" integrity="sha384-Zenh87qX5JnK2Jl0vWa8Ck2rdkQ2Bzep5IDxbcnCeuOxjzrPF/et3URy9Bv1WTRi" crossorigin="anonymous">
+    <link rel="stylesheet" href="assets/grades.css">
+  </head>
+  <body>
+<nav class="navbar navbar-expand-lg navbar-dark bg-primary">
+  <div class="container">
+    <a class="navbar-brand" href="#">
+        <img alt="Logo" width="28" height="33" class="d-inline-block align-text-top" src="https://www.bernardi.cloud/school/cc.png">
+        GRADE CHARTS, TERM $term
+    </a>
+  </div>
+</nav>
+  <div class="container text-center">
+    <h1>Insufficient grades by class and subject</h1>
+    <table class="table table-sm table-hover">
+      <thead><tr><th>Class</th><th>Students</th><th>Average</th><th>Insufficient</th>$subjects</tr></thead>
+      <tbody>
+"""
+)
+INDEX_ROW = Template(
+    """<tr><td><a href="$link">$class_</a></td><td>$students</td><td>$avg</td><th>$total</th>$counts</tr>\n"""
+)
+INDEX_FOOTER = Template(
+    """      </tbody>
+      <tfoot><tr><th>School</th><th>$students</th><th></th><th>$total</th>$counts</tr></tfoot>
+    </table>
+  </div>
+</body></html>
+"""
+)
+
+
+def copy_assets(out_dir: str):
+    """
+    Copy the shared CSS and JS of the reports into out_dir/assets, unless
+    they are already up to date.
+    """
+    assets_dir = os.path.join(out_dir, "assets")
+    os.makedirs(assets_dir, exist_ok=True)
+    for name in ASSETS:
+        source = os.path.join(ASSETS_DIR, name)
+        target = os.path.join(assets_dir, name)
+        if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source):
+            shutil.copy2(source, target)
+
+
+def subject_list(subjects: Iterable[str]) -> str:
+    return ", ".join(html.escape(s).replace(" ", "&nbsp;") for s in subjects)
+
+
+def insufficient_by_subject(matrix: GradeMatrix) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for subject, count in zip(matrix.short_subjects, matrix.subject_counts().tolist()):
+        counts[subject] = counts.get(subject, 0) + count
+    return counts
+
+
+def write_report(f: TextIO, class_: str, matrix: GradeMatrix):
+    """
+    Write the HTML grades report of a class.
+    """
+    averages = matrix.averages().tolist()
+    insufficient = matrix.between(4, 5.5).tolist()
+    very_bad = matrix.between(-1, 4).tolist()
+    bad_grades_by_subject = {s: n for s, n in insufficient_by_subject(matrix).items() if n}
+    bad_grades_by_subject = dict(reversed(sorted(bad_grades_by_subject.items(), key=lambda item: item[1])))
+
+    f.write(HEADER.substitute(class_=html.escape(class_)))
+    students = []
+    grades = []
+    for i, (student, row) in enumerate(zip(matrix.students, matrix.grades.tolist())):
+        name = f"{i+1}. {student.name.upper()}"
+        students.append(name)
+        grades.append([0 if g != g else g for g in row])  # NaN, no grade
+        if (i % COLS_PER_ROW) == 0:
+            f.write(ROW_START.substitute(cols=COLS_PER_ROW))
+        css = ""
+        avg = averages[i]
+        avg_str = "" if avg != avg else f"{avg:.1f}"
+        bad_str = ""
+        bad_subjects = [
+            f"{s} ({g})" for s, g, bad in zip(matrix.short_subjects, row, insufficient[i]) if bad
+        ]
+        if bad_subjects:
+            css = " border-danger text-danger"
+            n = len(bad_subjects)
+            bad_str += f"<br>{n} insufficient grade{n > 1 and 's' or ''}: {subject_list(bad_subjects)}"
+        very_bad_subjects = [
+            f"{s} ({g})" for s, g, bad in zip(matrix.short_subjects, row, very_bad[i]) if bad
+        ]
+        if very_bad_subjects:
+            css = " border-danger text-danger"
+            n = len(very_bad_subjects)
+            bad_str += f"<br>{n} very bad grade{n > 1 and 's' or ''}: {subject_list(very_bad_subjects)}"
+        if avg >= 8:
+            css = " border-success text-success"
+        f.write(CARD.substitute(css=css, name=html.escape(name), i=i, avg=avg_str, bad=bad_str))
+        if (i % COLS_PER_ROW) == (COLS_PER_ROW - 1):
+            f.write("</div>\n")
+    # Close the last row, if needed
+    if len(matrix) % COLS_PER_ROW:
+        f.write("</div>\n")
+    data = {
+        "subjects": matrix.short_subjects,
+        "students": students,
+        "grades": grades,
+        "badGrades": {
+            "subjects": list(bad_grades_by_subject.keys()),
+            "counts": list(bad_grades_by_subject.values()),
+        },
     }
-});
-</script></body></html>""")
-    print("Output saved as", outfile)
+    # Compact JSON, with "</" escaped so that it can't close the script
+    data_js = json.dumps(data, separators=(",", ":")).replace("</", "<\\/")
+    f.write(FOOTER.substitute(data=data_js))
+
+
+def report_file(out_dir: str, class_: str) -> str:
+    return os.path.join(out_dir, "grades_" + class_ + ".html")
+
+
+def render_report(path: str, class_: str, matrix: GradeMatrix):
+    """
+    Save the HTML grades report of a class (it runs in a worker process).
+    """
+    with open(path, "w") as f:
+        write_report(f, class_, matrix)
+
+
+def grade_drops(
+    old: GradeMatrix, new: GradeMatrix, min_drop: float
+) -> List[Tuple[str, str, float, float]]:
+    """
+    Return the (student, subject, old grade, new grade) averages that
+    dropped by at least min_drop, matching students and subjects by name.
+    """
+    old_row = {s.name: i for i, s in enumerate(old.students)}
+    old_column = {s: j for j, s in enumerate(old.subjects)}
+    rows = [(i, old_row[s.name]) for i, s in enumerate(new.students) if s.name in old_row]
+    columns = [(j, old_column[s]) for j, s in enumerate(new.subjects) if s in old_column]
+    if not rows or not columns:
+        return []
+    new_rows, old_rows = (list(r) for r in zip(*rows))
+    new_columns, old_columns = (list(c) for c in zip(*columns))
+    new_grades = new.grades[new_rows][:, new_columns]
+    old_grades = old.grades[old_rows][:, old_columns]
+    drops = []
+    for i, j in zip(*((old_grades - new_grades) >= min_drop).nonzero()):
+        drops.append(
+            (
+                new.students[new_rows[i]].name,
+                new.short_subjects[new_columns[j]],
+                float(old_grades[i, j]),
+                float(new_grades[i, j]),
+            )
+        )
+    return drops
+
+
+def print_trend(
+    store: GradeSnapshotStore,
+    class_: str,
+    term: str,
+    min_drop: float,
+    subjects: Optional[List[str]] = None,
+):
+    """
+    Print the drops of the averages of a class in a term since the
+    previous snapshot of the term and since the latest snapshot of each
+    previous term.
+    """
+    snapshots = store.snapshots(class_, term)
+    if not snapshots:
+        print(f"{class_}: no snapshots in term {term}")
+        return
+    latest = store.load(class_, term, snapshots[-1], subjects)
+    comparisons = []
+    if len(snapshots) > 1:
+        comparisons.append((term, snapshots[-2]))
+    for old_term in store.terms(class_):
+        if old_term < term:
+            comparisons.append((old_term, store.snapshots(class_, old_term)[-1]))
+    print(f"{class_}, term {term} ({snapshots[-1]:%Y-%m-%d %H:%M})")
+    for old_term, timestamp in comparisons:
+        old = store.load(class_, old_term, timestamp, subjects)
+        drops = grade_drops(old, latest, min_drop)
+        print(f"   since term {old_term} ({timestamp:%Y-%m-%d %H:%M}): {len(drops)} drops")
+        for name, subject, old_grade, new_grade in drops:
+            print(f"      {name}  {subject}: {old_grade:g} -> {new_grade:g} ({new_grade - old_grade:+g})")
+    if not comparisons:
+        print("   nothing to compare with yet")
+
+
+def write_index(f: TextIO, term: str, matrices: Dict[str, GradeMatrix]):
+    """
+    Write the school-level page with the insufficient grades of each
+    class by subject (and their totals), linking the reports of the classes.
+    """
+    by_class = {class_: insufficient_by_subject(m) for class_, m in matrices.items()}
+    school: Dict[str, int] = {}
+    for counts in by_class.values():
+        for subject, count in counts.items():
+            school[subject] = school.get(subject, 0) + count
+    subjects = sorted(school, key=lambda subject: (-school[subject], subject))
+
+    header = "".join(f"<th>{html.escape(s)}</th>" for s in subjects)
+    f.write(INDEX_HEADER.substitute(term=html.escape(term), subjects=header))
+    for class_, counts in by_class.items():
+        matrix = matrices[class_]
+        averages = [a for a in matrix.averages().tolist() if a == a]
+        f.write(
+            INDEX_ROW.substitute(
+                link=html.escape(os.path.basename(report_file("", class_))),
+                class_=html.escape(class_),
+                students=len(matrix),
+                avg=f"{sum(averages) / len(averages):.1f}" if averages else "",
+                total=sum(counts.values()),
+                counts="".join(f"<td>{counts.get(s, '') or ''}</td>" for s in subjects),
+            )
+        )
+    f.write(
+        INDEX_FOOTER.substitute(
+            students=sum(len(m) for m in matrices.values()),
+            total=sum(school.values()),
+            counts="".join(f"<th>{school[s]}</th>" for s in subjects),
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("section", nargs="?", help="omitted with --all")
+    parser.add_argument("term")
+    parser.add_argument(
+        "-a", "--all", help="report all the classes of the coordinator", action="store_true"
+    )
+    parser.add_argument(
+        "-t", "--trend", help="compare the saved snapshots instead of fetching the grades", action="store_true"
+    )
+    parser.add_argument(
+        "-d", "--min-drop", type=float, default=1.0, help="smallest drop shown by --trend (default: 1)"
+    )
+    parser.add_argument("-s", "--subjects", nargs="+", help="subjects compared by --trend (default: all)")
+    args = parser.parse_args()
+    if bool(args.all) == bool(args.section):
+        parser.error("either a section or --all is required")
+    term = args.term
+    store = GradeSnapshotStore()
+    if args.trend:
+        for class_ in store.class_names() if args.all else [args.section]:
+            print_trend(store, class_, term, args.min_drop, args.subjects)
+        exit(0)
+
+    cv = ClasseViva(USERNAME, PASSWORD)
+    classes = cv.get_classes()
+    copy_assets("reports")
+    if not args.all:
+        class_ = args.section
+        classes = [c for c in classes if c.name == class_]
+        if not classes:
+            print("Section not found:", class_)
+            exit(1)
+        matrix = cv.get_grade_matrix(classes[0], term)
+        store.save(class_, term, matrix)
+        outfile = report_file("reports", class_)
+        render_report(outfile, class_, matrix)
+        print("Output saved as", outfile)
+        exit(0)
+
+    # The grades of all the classes are fetched concurrently with the
+    # same session, and each report is rendered in a pool of processes
+    # as soon as its grades arrive (the processes are spawned, not forked:
+    # a fork would copy the session in the middle of the requests)
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    matrices = {}
+    with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as pool:
+        jobs = []
+        for c, matrix in cv.fetch_concurrently(lambda c: cv.get_grade_matrix(c, term), classes):
+            matrices[c.name] = matrix
+            store.save(c.name, term, matrix)
+            jobs.append(pool.submit(render_report, report_file("reports", c.name), c.name, matrix))
+        for job in jobs:
+            job.result()
+    matrices = {c.name: matrices[c.name] for c in classes}
+    outfile = os.path.join("reports", f"grades_index_{term}.html")
+    with open(outfile, "w") as f:
+        write_index(f, term, matrices)
+    print(f"{len(matrices)} class reports saved, index saved as", outfile)
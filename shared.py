@@ -10,14 +10,234 @@
 # fragile, but the thrill is worth it. :-D
 #
 
-from datetime import datetime
-from typing import Callable, List, Optional, Union
+from __future__ import annotations
 
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    IO,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+import hashlib
+import json
+import os
+import pickle
 import re
-import requests
-from bs4 import BeautifulSoup, Tag  # type: ignore
+import sqlite3
+import threading
+import time
+import unicodedata
+
+# requests and bs4 are imported only when needed, so that the tools
+# that can work offline (e.g. find_student.py) start faster
+if TYPE_CHECKING:
+    import requests
+    import numpy as np  # type: ignore
+    from bs4 import BeautifulSoup, SoupStrainer, Tag  # type: ignore
+
+# What the tools get with "from shared import *", along with the settings
+# (see below): the modules imported above stay here (time would replace
+# datetime.time, for instance)
+__all__ = [
+    # Types and helpers
+    "datetime",
+    "timedelta",
+    "Callable",
+    "Dict",
+    "IO",
+    "Iterable",
+    "Iterator",
+    "List",
+    "Optional",
+    "Tuple",
+    "Union",
+    # Optional settings
+    "CACHE_DIR",
+    "SESSION_MAX_AGE",
+    "MAX_WORKERS",
+    "STUDENT_INDEX_MAX_AGE",
+    "AGENDA_CHUNK_DAYS",
+    "AGENDA_SYNC_MAX_AGE",
+    "HTML_PARSER",
+    "SUBJECT_ALIASES_FILE",
+    "RESPONSE_CACHE_SIZE",
+    "RESPONSE_CACHE_TTL",
+    # Models
+    "parse_html",
+    "short_subject_name",
+    "SUBJECT_ALIASES",
+    "SUBJECT_RULES",
+    "Subject",
+    "Class",
+    "Student",
+    "Grade",
+    "StudentGrades",
+    "GradeMatrix",
+    "CompetenceLevel",
+    "CompetenceLevelTable",
+    "AgendaItem",
+    # ClasseViva and the stores
+    "ClasseViva",
+    "SessionStore",
+    "ResponseCache",
+    "CachingAdapter",
+    "TermUrlStore",
+    "StudentIndex",
+    "GradeSnapshotStore",
+    "AgendaStore",
+]
+
+# Defaults for the optional settings, they can be overridden in settings.py
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "classeviva-tools")
+SESSION_MAX_AGE = 4 * 60 * 60  # Seconds after which a saved session is discarded
+MAX_WORKERS = 8  # Maximum number of concurrent requests to ClasseViva
+STUDENT_INDEX_MAX_AGE = 7 * 24 * 60 * 60  # Seconds before a class is crawled again
+AGENDA_CHUNK_DAYS = 7  # Days of agenda fetched by each request
+AGENDA_SYNC_MAX_AGE = 20 * 60 * 60  # Seconds before a day of agenda is downloaded again (so, daily)
+HTML_PARSER = "html.parser"  # "html.parser", "lxml" or "" for the fastest installed parser
+SUBJECT_ALIASES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "subject_aliases.json")
+RESPONSE_CACHE_SIZE = 200 * 1024 * 1024  # Bytes of cached pages, 0 to disable the cache
+RESPONSE_CACHE_TTL = {  # Seconds each page is cached, by page name (0 = never, e.g. the term pages: see TermUrlStore)
+    "gioprof_selezione.php": 7 * 24 * 60 * 60,  # Subjects
+    "gioprof_coordinatore.php": 7 * 24 * 60 * 60,  # Classes of a coordinator
+    "selezione_classi.php": 7 * 24 * 60 * 60,  # All the classes
+    "regclasse.php": 3 * 24 * 60 * 60,  # Rosters
+    "recuperi_docente.php": 10 * 60,  # Tests
+    "coordinatore_medie.php": 10 * 60,  # Average grades
+}
 
 from settings import *
+import settings as _settings
+
+# Each tool needs only some of the settings, so those that are defined
+# are exported (mypy is told about the ones in settings.py.sample)
+if TYPE_CHECKING:
+    __all__ += [
+        "USERNAME",
+        "PASSWORD",
+        "AUTORE_ID",
+        "EXTRA_CLASS_IDS",
+        "EMAIL_USE_TLS",
+        "EMAIL_HOST",
+        "EMAIL_HOST_USER",
+        "EMAIL_HOST_PASSWORD",
+        "EMAIL_PORT",
+        "EMAIL_FROM",
+        "EMAIL_TO",
+    ]
+else:
+    __all__ += [name for name in vars(_settings) if name.isupper() and name not in __all__]
+
+
+def _default_html_parser() -> str:
+    """
+    Return lxml if it's installed (it's several times faster than the
+    pure Python parser on the larger pages), html.parser otherwise.
+    """
+    try:
+        import lxml  # type: ignore
+    except ImportError:
+        return "html.parser"
+    return "lxml"
+
+
+HTML_PARSER = HTML_PARSER or _default_html_parser()
+
+
+def parse_html(html: str, parse_only: Optional[SoupStrainer] = None) -> BeautifulSoup:
+    """
+    Build the soup of a ClasseViva page with the configured parser.
+    If parse_only is given, only the matching elements (and their
+    subtrees) are built, which is much cheaper on the larger pages.
+    """
+    from bs4 import BeautifulSoup  # type: ignore
+
+    return BeautifulSoup(html, HTML_PARSER, parse_only=parse_only)
+
+
+def _find_table_containing(soup: BeautifulSoup, text: str) -> Optional[Tag]:
+    """
+    Return the first (i.e. outermost) table containing the specified text,
+    even if it's split across inline tags or spaced differently. Only the
+    outermost tables are searched: a nested table can't contain a text
+    that its ancestors don't.
+    """
+    for table in soup.find_all("table"):
+        if table.find_parent("table") is None and text in " ".join(table.get_text().split()):
+            return table
+    return None
+
+
+def _makedirs_private(directory: str):
+    """
+    Create a directory of the cache, and its missing parents, readable
+    only by the user: the cache holds the names, birthdays and grades of
+    the students.
+    """
+    if directory and not os.path.isdir(directory):
+        _makedirs_private(os.path.dirname(directory))
+        try:
+            os.mkdir(directory, 0o700)
+        except FileExistsError:
+            pass
+
+
+def _open_private(path: str, mode: str = "wb") -> IO:
+    """
+    Open a cache file for writing, readable only by the user.
+    """
+    _makedirs_private(os.path.dirname(path))
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    return os.fdopen(fd, mode)
+
+
+def _connect_private(path: str) -> sqlite3.Connection:
+    """
+    Open a SQLite database of the cache, readable only by the user.
+    """
+    _makedirs_private(os.path.dirname(path))
+    os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+    return sqlite3.connect(path)
+
+
+def _css_class(name: str) -> re.Pattern:
+    """
+    Match an element with the specified class among its classes (when
+    parsing, the class attribute is still a single string).
+    """
+    return re.compile(r"(^|\s)" + re.escape(name) + r"(\s|$)")
+
+
+@lru_cache(maxsize=None)
+def _strainer(part: str) -> SoupStrainer:
+    """
+    Return the SoupStrainer of the part of a page actually needed by a scraper.
+    """
+    from bs4 import SoupStrainer  # type: ignore
+
+    if part == "tables":
+        return SoupStrainer("table")
+    if part == "class links":
+        return SoupStrainer("a", href=re.compile(r"regclasse\.php"))
+    if part == "student cells":
+        return SoupStrainer("td", class_=_css_class("elenco_studenti"))
+    if part == "avg grades":
+        return SoupStrainer(["th", "table"])
+    if part == "term links":
+        return SoupStrainer("span")
+    if part == "main container":
+        return SoupStrainer("div", class_=_css_class("main-container"))
+    raise ValueError(f"Unknown page part: {part}")
 
 
 class Subject:
@@ -67,6 +287,51 @@ class Student:
         return f"{self.name} ({self.birthday.strftime('%Y-%m-%d')})"
 
 
+# Short names of the subjects: first the exact names (including the ones
+# in SUBJECT_ALIASES_FILE), then the first rule whose words are all found
+# in the subject name
+SUBJECT_ALIASES = {
+    "educazione civica": "ed civica",
+    "economia politica": "ec. politica",
+}
+SUBJECT_RULES = [
+    (("francese",), "francese"),
+    (("inglese",), "inglese"),
+    (("spagnolo",), "spagnolo"),
+    (("tecnologie informatiche",), "lab. informatica"),
+    (("integrate", "fisica"), "fisica"),
+    (("integrate", "terra"), "sc. della terra"),
+    (("letteratura",), "italiano"),
+    (("motorie",), "ed. fisica"),
+    (("aziendale",), "ec. aziendale"),
+    (("cattolica",), "religione"),
+]
+
+
+@lru_cache(maxsize=None)
+def _subject_aliases() -> Dict[str, str]:
+    aliases = dict(SUBJECT_ALIASES)
+    if SUBJECT_ALIASES_FILE and os.path.exists(SUBJECT_ALIASES_FILE):
+        with open(SUBJECT_ALIASES_FILE, "r", encoding="utf-8") as f:
+            aliases.update(json.load(f))
+    return aliases
+
+
+@lru_cache(maxsize=None)
+def short_subject_name(subject: str) -> str:
+    """
+    Return the short name of a subject (e.g. "lingua inglese" -> "inglese"),
+    or the subject itself if there is none.
+    """
+    aliases = _subject_aliases()
+    if subject in aliases:
+        return aliases[subject]
+    for words, short_name in SUBJECT_RULES:
+        if all(word in subject for word in words):
+            return short_name
+    return subject
+
+
 class Grade:
     """
     A grade in a specific subject.
@@ -80,31 +345,7 @@ class Grade:
         self.grade = None
 
     def sanitized_subject(self) -> str:
-        if self.subject == "educazione civica":
-            return "ed civica"
-        if "francese" in self.subject:
-            return "francese"
-        if "inglese" in self.subject:
-            return "inglese"
-        if "spagnolo" in self.subject:
-            return "spagnolo"
-        if "tecnologie informatiche" in self.subject:
-            return "lab. informatica"
-        if "integrate" in self.subject and "fisica" in self.subject:
-            return "fisica"
-        if "integrate" in self.subject and "terra" in self.subject:
-            return "sc. della terra"
-        if "letteratura" in self.subject:
-            return "italiano"
-        if "motorie" in self.subject:
-            return "ed. fisica"
-        if "aziendale" in self.subject:
-            return "ec. aziendale"
-        if self.subject == "economia politica":
-            return "ec. politica"
-        if "cattolica" in self.subject:
-            return "religione"
-        return self.subject
+        return short_subject_name(self.subject)
 
 
 class StudentGrades:
@@ -165,35 +406,180 @@ class StudentGrades:
         return f"{self.student.name} -> {' '.join(str(g) for g in self.grades)}"
 
 
+class GradeMatrix:
+    """
+    Grades of the students of a class (rows) in each subject (columns),
+    stored as a float array with NaN for the missing grades. The
+    StudentGrades of each student are available as views, e.g. by
+    iterating over the matrix. The short names of the subjects are
+    computed once, in short_subjects.
+    """
+
+    def __init__(self, students: List[Student], subjects: List[str], grades: "np.ndarray"):
+        self.students = students
+        self.subjects = subjects
+        self.short_subjects = [short_subject_name(subject) for subject in subjects]
+        self.grades = grades
+
+    @classmethod
+    def from_rows(
+        cls, students: List[Student], subjects: List[str], rows: List[List[Optional[float]]]
+    ) -> "GradeMatrix":
+        import numpy as np
+
+        grades = np.full((len(rows), len(subjects)), np.nan)
+        for i, row in enumerate(rows):
+            grades[i, : len(row)] = [np.nan if g is None else g for g in row]
+        return cls(students, subjects, grades)
+
+    def __len__(self) -> int:
+        return len(self.students)
+
+    def __getitem__(self, i: int) -> StudentGrades:
+        sg = StudentGrades(self.students[i])
+        for subject, grade in zip(self.subjects, self.grades[i].tolist()):
+            g = Grade()
+            g.subject = subject
+            g.grade = None if grade != grade else grade  # NaN
+            sg.grades.append(g)
+        return sg
+
+    def __iter__(self) -> Iterator[StudentGrades]:
+        return (self[i] for i in range(len(self)))
+
+    def between(self, from_grade: float = 0, to_grade: float = 5.5) -> "np.ndarray":
+        """
+        Return a boolean matrix of the grades that are > from_grade and
+        <= to_grade (the same bounds of StudentGrades.bad_grades).
+        """
+        import numpy as np
+
+        with np.errstate(invalid="ignore"):
+            return (self.grades > from_grade) & (self.grades <= to_grade)
+
+    def averages(self) -> "np.ndarray":
+        """
+        Average grade of each student, NaN for those without grades.
+        """
+        return self._nanmean(axis=1)
+
+    def subject_averages(self) -> "np.ndarray":
+        """
+        Average grade in each subject, NaN for those without grades.
+        """
+        return self._nanmean(axis=0)
+
+    def student_counts(self, from_grade: float = 0, to_grade: float = 5.5) -> "np.ndarray":
+        return self.between(from_grade, to_grade).sum(axis=1)
+
+    def subject_counts(self, from_grade: float = 0, to_grade: float = 5.5) -> "np.ndarray":
+        return self.between(from_grade, to_grade).sum(axis=0)
+
+    def _nanmean(self, axis: int) -> "np.ndarray":
+        import numpy as np
+
+        # Same as np.nanmean, without the warnings for the all-NaN slices
+        present = ~np.isnan(self.grades)
+        total = np.where(present, self.grades, 0).sum(axis=axis)
+        count = present.sum(axis=axis)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return total / count
+
+
 class CompetenceLevel:
     """
     List of competence levels of a specific class. Each competence level
     is characterized by a name (e.g. "Below sufficiency (<=4)", a function
     int -> bool that tests whether or not a score belongs to this level,
     a counter and a percentage indicator (these two values are meant to
-    be managed by a function that computes them).
+    be managed by a function that computes them). The optional upper bound
+    (the highest score of the level, None for the last one) is required by
+    the batch computation, which bins the scores instead of testing them:
+    build the levels with from_bounds, so that the two always agree.
     """
 
-    def __init__(self, name: str, test_function: Callable[[int], bool]):
+    def __init__(
+        self,
+        name: str,
+        test_function: Callable[[int], bool],
+        upper: Optional[float] = None,
+    ):
         self.name = name
         self.count = 0
         self.perc = 0
         self.test_function = test_function
+        self.upper = upper
+
+    @classmethod
+    def from_bounds(cls, levels: List[Tuple[str, Optional[float]]]) -> List["CompetenceLevel"]:
+        """
+        Build the competence levels from their (name, upper bound) pairs,
+        in increasing order and with None as the bound of the last one:
+        each level holds the scores above the previous bound, up to its own.
+        """
+        result = []
+        lower = None
+        for name, upper in levels:
+            test_function = lambda x, lower=lower, upper=upper: (lower is None or x > lower) and (
+                upper is None or x <= upper
+            )
+            result.append(cls(name, test_function, upper))
+            lower = upper
+        return result
 
     def __str__(self):
         return f"{self.name} {self.perc}% ({self.count})"
 
 
+class CompetenceLevelTable:
+    """
+    Competence levels of a class for all of its tests at once: counts and
+    percs are (levels x tests) arrays, missing lists the students that
+    didn't take each test.
+    """
+
+    def __init__(
+        self,
+        competencies: List[CompetenceLevel],
+        counts: "np.ndarray",
+        percs: "np.ndarray",
+        missing: List[List[Student]],
+    ):
+        self.competencies = competencies
+        self.counts = counts
+        self.percs = percs
+        self.missing = missing
+
+    def __len__(self) -> int:
+        return self.counts.shape[1]
+
+    def levels(self, test: int) -> Optional[List[CompetenceLevel]]:
+        """
+        Return new competence levels with the count and perc of a test,
+        or None if nobody took it (or there is no such test).
+        """
+        if test >= len(self) or not self.counts[:, test].any():
+            return None
+        levels = []
+        for i, c in enumerate(self.competencies):
+            level = CompetenceLevel(c.name, c.test_function, c.upper)
+            level.count = int(self.counts[i, test])
+            level.perc = int(self.percs[i, test])
+            levels.append(level)
+        return levels
+
+
 class AgendaItem:
     def __init__(
         self,
         title: str,
-        start: str,
-        end: str,
+        start: datetime,
+        end: datetime,
         all_day: bool,
         note: str,
         author_desc: str,
         class_desc: str,
+        id: Optional[str] = None,
     ):
         self.title = title
         self.start = start
@@ -202,15 +588,26 @@ class AgendaItem:
         self.note = note
         self.author_desc = author_desc
         self.class_desc = class_desc
+        self.id = id
+
+    def key(self) -> Tuple:
+        """
+        Identity of the event, to merge the same event found in more
+        requests: its id, or its contents if it hasn't got one.
+        """
+        if self.id is not None:
+            return (self.id,)
+        return (self.start, self.end, self.title, self.note, self.class_desc)
 
     def __str__(self):
         return f"{self.start.strftime('%A %-d %B')} {self.class_desc} - {self.author_desc}: {self.note}".replace(
             ":00 ", " "
         )
 
-    def html(self):
+    def html(self, change: Optional[str] = None):
+        change_td = f"<td><strong>{change}</strong></td>" if change else ""
         return f"""
-<tr>
+<tr>{change_td}
 <td>{self.start.strftime('%A %-d %B')}</td>
 <td>{self.class_desc}</td>
 <td>{self.author_desc}</td>
@@ -224,9 +621,345 @@ class AgendaItem:
         return self.__str__()
 
 
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class SessionStore:
+    """
+    On-disk store of the authenticated session cookies, so that
+    different processes (e.g. cron jobs for many teachers) can reuse
+    the same login instead of authenticating every time. There is
+    one file per user name and sessions older than max_age seconds
+    are ignored.
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_age: int = SESSION_MAX_AGE):
+        self.directory = os.path.expanduser(directory)
+        self.max_age = max_age
+
+    def _path(self, username: str) -> str:
+        digest = hashlib.sha1(username.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"session_{digest}.pickle")
+
+    def load(self, username: str) -> Optional[requests.cookies.RequestsCookieJar]:
+        """
+        Return the saved cookies for the specified user, or None if there
+        is no saved session or the saved session has expired.
+        """
+        try:
+            with open(self._path(username), "rb") as f:
+                saved = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if time.time() - saved["timestamp"] > self.max_age:
+            return None
+        return saved["cookies"]
+
+    def save(self, username: str, cookies: requests.cookies.RequestsCookieJar):
+        path = self._path(username)
+        # The cookies are as good as a password, keep them private
+        with _open_private(path + ".tmp") as f:
+            pickle.dump({"timestamp": time.time(), "cookies": cookies}, f)
+        os.replace(path + ".tmp", path)
+
+    def clear(self, username: str):
+        try:
+            os.remove(self._path(username))
+        except FileNotFoundError:
+            pass
+
+
+class ResponseCache:
+    """
+    On-disk cache of the pages downloaded from ClasseViva. How long a
+    page stays fresh depends on its name (see RESPONSE_CACHE_TTL); once
+    stale, it's revalidated with a conditional request if the server
+    sent an ETag or a Last-Modified header. When the total size exceeds
+    max_size bytes, the least recently used pages are evicted.
+    """
+
+    def __init__(
+        self,
+        directory: str = os.path.join(CACHE_DIR, "responses"),
+        max_size: int = RESPONSE_CACHE_SIZE,
+        ttl: Dict[str, int] = RESPONSE_CACHE_TTL,
+    ):
+        self.directory = os.path.expanduser(directory)
+        self.max_size = max_size
+        self.ttl_by_page = ttl
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._size: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def ttl(self, method: str, url: str) -> int:
+        """
+        Return the number of seconds the response to a request stays
+        fresh (0 means that it isn't cacheable at all).
+        """
+        if method != "GET" or self.max_size <= 0:
+            return 0
+        page = url.split("?")[0].rsplit("/", 1)[-1]
+        return self.ttl_by_page.get(page, 0)
+
+    def _path(self, namespace: str, url: str) -> str:
+        digest = hashlib.sha1(f"{namespace} {url}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def load(self, namespace: str, url: str) -> Optional[dict]:
+        path = self._path(namespace, url)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(path)  # The modification time is the LRU order
+        return entry
+
+    def save(self, namespace: str, url: str, entry: dict):
+        path = self._path(namespace, url)
+        data = pickle.dumps(entry)
+        with self._lock:
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            with _open_private(path + ".tmp") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+            if self._size is None:
+                self._size = self.size()
+            else:
+                self._size += len(data) - old_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def size(self) -> int:
+        """
+        Total size of the cached pages, in bytes.
+        """
+        try:
+            return sum(e.stat().st_size for e in os.scandir(self.directory))
+        except OSError:
+            return 0
+
+    def _evict(self):
+        entries = sorted(os.scandir(self.directory), key=lambda e: e.stat().st_mtime)
+        self._size = sum(e.stat().st_size for e in entries)
+        # Leave some room, otherwise every new page would evict another one
+        target = self.max_size * 9 // 10
+        for e in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(e.path)
+                self._size -= e.stat().st_size
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            if os.path.isdir(self.directory):
+                for e in os.scandir(self.directory):
+                    os.remove(e.path)
+            self._size = 0
+
+    def __str__(self):
+        return (
+            f"{self.hits} cache hits, {self.misses} misses, "
+            f"{self.revalidations} revalidated"
+        )
+
+
+class CachingAdapter:
+    """
+    HTTP adapter (see requests.adapters.BaseAdapter) that serves the
+    cacheable requests from a ResponseCache and sends the others through
+    a regular HTTPAdapter, built with the specified keyword arguments.
+    The namespace keeps apart the pages of different users, which have
+    the same URLs but different contents.
+    """
+
+    def __init__(self, cache: ResponseCache, namespace: str, **kwargs):
+        from requests.adapters import HTTPAdapter
+
+        self.adapter = HTTPAdapter(**kwargs)
+        self.cache = cache
+        self.namespace = namespace
+
+    def close(self):
+        self.adapter.close()
+
+    def _cached_response(self, request, entry: dict) -> requests.Response:
+        import requests
+
+        res = requests.Response()
+        res.status_code = 200
+        res.reason = "OK"
+        res.headers = requests.structures.CaseInsensitiveDict(entry["headers"])
+        res.encoding = entry["encoding"]
+        res._content = entry["content"]
+        res._content_consumed = True
+        res.url = request.url
+        res.request = request
+        res.connection = self
+        return res
+
+    def send(self, request, **kwargs):
+        ttl = self.cache.ttl(request.method, request.url)
+        if not ttl:
+            return self.adapter.send(request, **kwargs)
+        entry = self.cache.load(self.namespace, request.url)
+        if entry and time.time() - entry["timestamp"] < ttl:
+            self.cache.hits += 1
+            return self._cached_response(request, entry)
+        if entry:
+            if "ETag" in entry["headers"]:
+                request.headers["If-None-Match"] = entry["headers"]["ETag"]
+            if "Last-Modified" in entry["headers"]:
+                request.headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        res = self.adapter.send(request, **kwargs)
+        if entry and res.status_code == 304:
+            res.close()  # Release the connection to the pool
+            self.cache.revalidations += 1
+            entry["timestamp"] = time.time()
+            self.cache.save(self.namespace, request.url, entry)
+            return self._cached_response(request, entry)
+        self.cache.misses += 1
+        if res.status_code == 200:
+            entry = {
+                "timestamp": time.time(),
+                "headers": dict(res.headers),
+                "encoding": res.encoding,
+                "content": res.content,
+            }
+            self.cache.save(self.namespace, request.url, entry)
+        return res
+
+
+class TermUrlStore:
+    """
+    On-disk store of the URLs of the term pages (grades and tests) of
+    each subject, which don't change during a school year: they are
+    discovered once per school year instead of once per run.
+    """
+
+    def __init__(self, path: str = os.path.join(CACHE_DIR, "term_urls.json")):
+        self.path = os.path.expanduser(path)
+        self._urls: Optional[Dict[str, List[List[str]]]] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def school_year(date: Optional[datetime] = None) -> str:
+        """
+        Return the school year of a date (e.g. "2023/2024"), which
+        starts in September.
+        """
+        date = date or datetime.now()
+        year = date.year if date.month >= 9 else date.year - 1
+        return f"{year}/{year + 1}"
+
+    @staticmethod
+    def _key(username: str, subject: Subject) -> str:
+        return f"{username} {subject.class_id} {subject.subject}"
+
+    def _load(self) -> Dict[str, List[List[str]]]:
+        if self._urls is None:
+            try:
+                with open(self.path, "r") as f:
+                    saved = json.load(f)
+            except (OSError, ValueError):
+                saved = {}
+            if saved.get("school_year") == self.school_year():
+                self._urls = saved["subjects"]
+            else:
+                self._urls = {}
+        return self._urls
+
+    def get(
+        self, username: str, subject: Subject
+    ) -> Optional[Tuple[List[str], List[str]]]:
+        """
+        Return the grade and test URLs of each term of a subject, or None
+        if they haven't been discovered yet in this school year.
+        """
+        with self._lock:
+            urls = self._load().get(self._key(username, subject))
+        if not urls or not urls[0]:
+            return None
+        return list(urls[0]), list(urls[1])
+
+    def put(
+        self,
+        username: str,
+        subject: Subject,
+        url_grades_term: List[str],
+        url_tests_term: List[str],
+    ):
+        with self._lock:
+            urls = self._load()
+            urls[self._key(username, subject)] = [url_grades_term, url_tests_term]
+            with _open_private(self.path + ".tmp", "w") as f:
+                json.dump({"school_year": self.school_year(), "subjects": urls}, f)
+            os.replace(self.path + ".tmp", self.path)
+
+
 class ClasseViva:
-    def __init__(self, username: str, password: str):
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        session_store: Optional[SessionStore] = SessionStore(),
+        max_workers: int = MAX_WORKERS,
+        cache: Optional[ResponseCache] = ResponseCache(),
+        term_urls: Optional[TermUrlStore] = TermUrlStore(),
+    ):
+        """
+        Open a session with ClasseViva. If a session store is given, the
+        cookies of a previous login are reused (no HTTP round trips at
+        all) and a new login is performed only when the server rejects
+        them; pass session_store=None to always log in from scratch.
+        max_workers is the default limit of in-flight requests for the
+        concurrent fetch methods. The pages are served from the response
+        cache while fresh; pass cache=None to always download them.
+        The term URLs of the subjects are looked up in term_urls.
+        """
+        import requests
+
+        self.username = username
+        self.password = password
+        self.session_store = session_store
+        self.max_workers = max_workers
+        self.cache = cache
+        self.term_urls = term_urls
         self.session = requests.session()
+        # Keep one connection per worker alive, so that concurrent fetches
+        # share the authenticated session without opening new connections
+        if cache:
+            adapter = CachingAdapter(
+                cache, username, pool_connections=1, pool_maxsize=max_workers
+            )
+        else:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=max_workers
+            )
+        self.session.mount("https://", adapter)
+        self._login_lock = threading.Lock()
+        self._login_count = 0
+        cookies = session_store and session_store.load(username)
+        if cookies:
+            self.session.cookies.update(cookies)
+        else:
+            self.login()
+
+    def login(self):
+        """
+        Perform the three-step login on the ClasseViva website and,
+        if possible, save the resulting session for later use.
+        """
+        self.session.cookies.clear()
         res = self.session.get(
             "https://web.spaggiari.eu/home/app/default/login.php?target=cvv&mode="
         )
@@ -234,8 +967,8 @@ class ClasseViva:
         res = self.session.post(
             "https://web.spaggiari.eu/auth-p7/app/default/AuthApi4.php?a=aLoginPwd",
             data={
-                "uid": username,
-                "pwd": password,
+                "uid": self.username,
+                "pwd": self.password,
                 "cid": "",
                 "pin": "",
                 "target": "",
@@ -246,21 +979,74 @@ class ClasseViva:
             "https://web.spaggiari.eu/home/app/default/login_ok_redirect.php"
         )
         res.raise_for_status()
+        self._login_count += 1
+        if self.session_store:
+            self.session_store.save(self.username, self.session.cookies)
+
+    @staticmethod
+    def _is_login_page(res: requests.Response) -> bool:
+        """
+        An expired or invalid session is redirected to the login page.
+        """
+        return "/login.php" in res.url or "/auth-p7/" in res.url
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Perform an HTTP request within the authenticated session. If the
+        server rejects the session cookies, log in again and retry once.
+        """
+        login_count = self._login_count
+        res = self.session.request(method, url, **kwargs)
+        res.raise_for_status()
+        if self._is_login_page(res):
+            with self._login_lock:
+                # Another thread may have logged in again in the meantime
+                if login_count == self._login_count:
+                    if self.session_store:
+                        self.session_store.clear(self.username)
+                    self.login()
+            res = self.session.request(method, url, **kwargs)
+            res.raise_for_status()
+        return res
+
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        return self._request("GET", url, **kwargs)
+
+    def _post(self, url: str, **kwargs) -> requests.Response:
+        return self._request("POST", url, **kwargs)
+
+    def fetch_concurrently(
+        self,
+        function: Callable[[T], R],
+        items: Iterable[T],
+        workers: Optional[int] = None,
+    ) -> Iterator[Tuple[T, R]]:
+        """
+        Call function (typically one of the get_* methods) on each item
+        with at most workers requests in flight, sharing this session.
+        The (item, result) pairs are yielded as soon as each call
+        finishes, so they are not in the same order as items.
+        """
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        with ThreadPoolExecutor(max_workers=workers or self.max_workers) as pool:
+            futures = {pool.submit(function, item): item for item in items}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
 
     def get_classes(self) -> List[Class]:
         """
         Return the list of the classes available for the current login,
         if the login is a coordinator.
         """
-        res = self.session.get(
+        res = self._get(
             "https://web.spaggiari.eu/cvv/app/default/gioprof_coordinatore.php"
         )
-        res.raise_for_status()
-        soup = BeautifulSoup(res.text, "html.parser")
-        tables = [t for t in soup.find_all("table") if "Valutazioni" in t.get_text()]
-        if not tables:
+        soup = parse_html(res.text, _strainer("tables"))
+        table = _find_table_containing(soup, "Valutazioni")
+        if not table:
             raise Exception("Table of classes not found")
-        rows = tables[0].find_all("tr", {"valign": "top"})[1:]
+        rows = table.find_all("tr", {"valign": "top"})[1:]
         classes = []
         for row in rows:
             tds = row.find_all("td")
@@ -273,11 +1059,10 @@ class ClasseViva:
         return classes
 
     def get_all_classes(self) -> List[Class]:
-        res = self.session.get(
+        res = self._get(
             "https://web.spaggiari.eu/cvv/app/default/selezione_classi.php"
         )
-        res.raise_for_status()
-        soup = BeautifulSoup(res.text, "html.parser")
+        soup = parse_html(res.text, _strainer("class links"))
         a_list = soup.find_all("a")
         classes = []
         for a in a_list:
@@ -292,9 +1077,8 @@ class ClasseViva:
         return classes
 
     def get_students_by_class(self, clazz: Class):
-        res = self.session.get(clazz.link)
-        res.raise_for_status()
-        soup = BeautifulSoup(res.text, "html.parser")
+        res = self._get(clazz.link)
+        soup = parse_html(res.text, _strainer("student cells"))
         students = []
         for td in soup.find_all("td", {"class": "elenco_studenti"}):
             s = Student()
@@ -307,23 +1091,27 @@ class ClasseViva:
             students.append(s)
         return students
 
+    def iter_students_by_classes(
+        self, classes: Iterable[Class], workers: Optional[int] = None
+    ) -> Iterator[Tuple[Class, List[Student]]]:
+        """
+        Fetch the students of many classes in parallel, yielding each
+        class with its students as soon as its page has been parsed.
+        """
+        return self.fetch_concurrently(self.get_students_by_class, classes, workers)
+
     def get_subjects(self) -> List[Subject]:
         """
         Return the list of subject available for the current login.
         """
-        res = self.session.get(
+        res = self._get(
             "https://web.spaggiari.eu/cvv/app/default/gioprof_selezione.php"
         )
-        res.raise_for_status()
-        soup = BeautifulSoup(res.text, "html.parser")
-        tables = [
-            t
-            for t in soup.find_all("table")
-            if "Giornale del professore" in t.get_text()
-        ]
-        if not tables:
+        soup = parse_html(res.text, _strainer("tables"))
+        table = _find_table_containing(soup, "Giornale del professore")
+        if not table:
             raise Exception("Table of classes not found")
-        rows = tables[0].find_all("tr", {"valign": "top"})[
+        rows = table.find_all("tr", {"valign": "top"})[
             1:
         ]  # The first row is the header
         subjects = []
@@ -343,11 +1131,19 @@ class ClasseViva:
         return subjects
 
     def get_avg_grades(self, class_: Class, term: str) -> List[StudentGrades]:
-        res = self.session.get(
+        return list(self.get_grade_matrix(class_, term))
+
+    def get_grade_matrix(self, class_: Class, term: str) -> GradeMatrix:
+        """
+        Return the average grades of the students of a class in each
+        subject in the specified term.
+        """
+        res = self._get(
             f"https://web.spaggiari.eu/cvv/app/default/coordinatore_medie.php?classe_id={class_.code}&quad={term}"
         )
-        res.raise_for_status()
-        soup = BeautifulSoup(res.text, "html.parser")
+        from bs4 import Tag  # type: ignore
+
+        soup = parse_html(res.text, _strainer("avg grades"))
         ths = soup.find_all("th", {"class": "materia"})
         subjects = [th.get_text().strip() for th in ths if isinstance(th, Tag)]
         tables = soup.find_all("table", {"id": "center_table"})
@@ -365,28 +1161,24 @@ class ClasseViva:
         # Grades
         tbody = tables[1].find("tbody")
         trs = tbody.find_all("tr")
-        student_grades = []
+        graded_students = []
+        rows = []
         for k, tr in enumerate(trs):
             tds = tr.find_all("td", {"class": "registro"})
             if not tds:
                 continue
             scores = [td.get_text().strip() for td in tds if isinstance(td, Tag)]
-            s = StudentGrades(students[k])
-            for i in range(len(subjects)):
-                g = Grade()
-                g.subject = subjects[i].replace(".", "").strip()
-                g.grade = scores[i] and float(scores[i]) or None
-                s.grades.append(g)
-            student_grades.append(s)
-        return student_grades
+            graded_students.append(students[k])
+            rows.append([scores[i] and float(scores[i]) or None for i in range(len(subjects))])
+        subjects = [subject.replace(".", "").strip() for subject in subjects]
+        return GradeMatrix.from_rows(graded_students, subjects, rows)
 
     def get_students(self, subject: Subject) -> List[Student]:
         """
         Return the list of the students for a specific subject.
         """
-        res = self.session.get(subject.url)
-        res.raise_for_status()
-        soup = BeautifulSoup(res.text, "html.parser")
+        res = self._get(subject.url)
+        soup = parse_html(res.text, _strainer("student cells"))
         students = []
         for td in soup.find_all("td", {"class": "elenco_studenti"}):
             s = Student()
@@ -398,15 +1190,22 @@ class ClasseViva:
             students.append(s)
         return students
 
-    def _get_grades_urls(self, subject: Subject):
+    def _get_grades_urls(self, subject: Subject, use_store: bool = True):
         """
         Detect the URLs to access the various grade pages for a
-        specific subject.
+        specific subject. Since they don't change during the school
+        year, the term URL store is looked up before the grades page
+        (unless use_store is False); only complete discoveries, with at
+        least one term, are stored.
         """
-        res = self.session.get(subject.url_grades)
-        res.raise_for_status()
-        soup = BeautifulSoup(res.text, "html.parser")
+        urls = use_store and self.term_urls and self.term_urls.get(self.username, subject)
+        if urls:
+            subject.url_grades_term, subject.url_tests_term = urls
+            return
+        res = self._get(subject.url_grades)
+        soup = parse_html(res.text, _strainer("term links"))
         subject.url_grades_term = []
+        subject.url_tests_term = []
         for span in soup.find_all("span"):
             try:
                 href = span["_href"]
@@ -418,6 +1217,10 @@ class ClasseViva:
                     )
             except KeyError:
                 pass
+        if self.term_urls and subject.url_grades_term:
+            self.term_urls.put(
+                self.username, subject, subject.url_grades_term, subject.url_tests_term
+            )
 
     def get_tests(
         self, subject: Subject, students: List[Student], term: int
@@ -426,12 +1229,14 @@ class ClasseViva:
         Returns the StudentGrades (list of grades associated to a specific
         student) of each student for a specific test.
         """
-        if not subject.url_grades_term or not subject.url_tests_term:
+        if not subject.url_tests_term:
             self._get_grades_urls(subject)
+        if term >= len(subject.url_tests_term):
+            # The term may have been published after the URLs were stored
+            self._get_grades_urls(subject, use_store=False)
         url = subject.url_tests_term[term]
-        res = self.session.get(url)
-        res.raise_for_status()
-        soup = BeautifulSoup(res.text, "html.parser")
+        res = self._get(url)
+        soup = parse_html(res.text, _strainer("main container"))
         main_container = soup.find("div", {"class": "main-container"})
         table = main_container.find("table")
         trs = table.find_all("tr")[1:]  # The first row is the header
@@ -491,6 +1296,49 @@ class ClasseViva:
             competencies[max_perc_idx].perc += 100 - sum_perc
         return missing_students
 
+    def compute_competence_levels_batch(
+        self,
+        competencies: List[CompetenceLevel],
+        grades: List[StudentGrades],
+    ) -> CompetenceLevelTable:
+        """
+        Same as compute_competence_levels, but for all the tests of a class
+        in one pass: the (students x tests) score matrix is binned on the
+        upper bounds of the competencies, which are left untouched.
+        """
+        import numpy as np
+
+        edges: List[float] = [c.upper for c in competencies[:-1] if c.upper is not None]
+        if len(edges) != len(competencies[:-1]):
+            raise ValueError("Every competence level but the last one needs an upper bound")
+        tests = max((len(g.grades) for g in grades), default=0)
+        scores = np.full((len(grades), tests), np.nan)
+        for i, g in enumerate(grades):
+            scores[i, : len(g.grades)] = [np.nan if s is None else s for s in g.grades]
+        taken = ~np.isnan(scores)
+        # The bounds must agree with the test functions, at least on the
+        # actual scores (there are few distinct ones)
+        for score in np.unique(scores[taken]).tolist():
+            level = int(np.digitize(score, edges, right=True))
+            tested = [i for i, c in enumerate(competencies) if c.test_function(score)]
+            if tested != [level]:
+                raise ValueError(
+                    f"The upper bounds and the test functions of the competence levels disagree on {score:g}"
+                )
+        # Level of each score (x <= edges[0] is 0, edges[0] < x <= edges[1] is 1...)
+        # and then the counts of each (level, test) pair in a single bincount
+        levels = np.digitize(scores, edges, right=True)
+        cells = levels * tests + np.arange(tests)
+        counts = np.bincount(cells[taken], minlength=len(competencies) * tests)
+        counts = counts.reshape(len(competencies), tests)
+        tot = taken.sum(axis=0)
+        percs = counts * 100 // np.maximum(tot, 1)
+        # If the sum isn't exactly 100, adjust the highest percentage
+        columns = np.flatnonzero(tot)
+        percs[percs.argmax(axis=0)[columns], columns] += 100 - percs.sum(axis=0)[columns]
+        missing = [[grades[i].student for i in np.flatnonzero(~taken[:, t])] for t in range(tests)]
+        return CompetenceLevelTable(competencies, counts, percs, missing)
+
     def get_agenda(
         self,
         start: str,
@@ -499,7 +1347,7 @@ class ClasseViva:
         class_id: str,
         classe_desc_alt: Optional[str] = None,
     ) -> List[AgendaItem]:
-        res = self.session.post(
+        res = self._post(
             f"https://web.spaggiari.eu/cvv/app/default/agenda.php?ope=get_events&mode=agenda&tutte_note=0",
             data={
                 "classe_id": class_id,
@@ -507,7 +1355,6 @@ class ClasseViva:
                 "end": end,
             },
         )
-        res.raise_for_status()
         items = []
         res_json = res.json()
         for j in res_json:
@@ -522,6 +1369,498 @@ class ClasseViva:
                     (j["nota_1"] + " " + j["nota_2"]).strip(),
                     j["autore_desc"],
                     j["classe_desc"] or classe_desc_alt,
+                    j.get("id"),
                 )
             )
         return items
+
+    def get_agenda_range(
+        self,
+        start: datetime,
+        end: datetime,
+        author_id: str,
+        class_ids: Dict[str, Optional[str]],
+        chunk_days: int = AGENDA_CHUNK_DAYS,
+        workers: Optional[int] = None,
+    ) -> List[AgendaItem]:
+        """
+        Return the agenda items of several classes (class_id ->
+        classe_desc_alt) between two dates, sorted by start. The range is
+        split into chunks of chunk_days, and the requests for every class
+        and chunk run concurrently; the events found by more than one
+        request are merged.
+        """
+        chunks = []
+        chunk_start = start
+        while chunk_start < end:
+            chunk_end = min(chunk_start + timedelta(days=chunk_days), end)
+            chunks.append((chunk_start.strftime("%Y-%m-%d"), chunk_end.strftime("%Y-%m-%d")))
+            chunk_start = chunk_end
+        jobs = [(class_id, chunk) for class_id in class_ids for chunk in chunks]
+        items: Dict[Tuple, AgendaItem] = {}
+        for _, chunk_items in self.fetch_concurrently(
+            lambda job: self.get_agenda(*job[1], author_id, job[0], class_ids[job[0]]),
+            jobs,
+            workers,
+        ):
+            for item in chunk_items:
+                items.setdefault(item.key(), item)
+        return sorted(items.values(), key=lambda item: item.start)
+
+
+class StudentIndex:
+    """
+    Local SQLite index of the students of every class of the school,
+    so that a search by name doesn't need to scrape every class
+    register. Names are stored normalized (upper case, no accents)
+    together with the class and the birthday; each class has its own
+    timestamp so that the index can be rebuilt one class at a time.
+    """
+
+    def __init__(
+        self,
+        path: str = os.path.join(CACHE_DIR, "students.sqlite3"),
+        max_age: int = STUDENT_INDEX_MAX_AGE,
+    ):
+        path = os.path.expanduser(path)
+        self.max_age = max_age
+        self.db = _connect_private(path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS classes (
+                code TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS students (
+                key TEXT NOT NULL,
+                name TEXT NOT NULL,
+                birthday TEXT,
+                class_code TEXT NOT NULL REFERENCES classes(code)
+            );
+            CREATE INDEX IF NOT EXISTS students_key ON students(key);
+            CREATE INDEX IF NOT EXISTS students_class ON students(class_code);
+            """
+        )
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        """
+        Return the search key of a name: upper case, without accents and
+        with single spaces (e.g. "  Nicolò  Rossi" -> "NICOLO ROSSI").
+        """
+        decomposed = unicodedata.normalize("NFKD", name)
+        stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+        return " ".join(stripped.upper().split())
+
+    def is_stale(self) -> bool:
+        """
+        Return True if the index is empty or some class is too old.
+        """
+        row = self.db.execute("SELECT COUNT(*), MIN(updated) FROM classes").fetchone()
+        return row[0] == 0 or time.time() - row[1] > self.max_age
+
+    def stale_classes(self, classes: Iterable[Class]) -> List[Class]:
+        """
+        Return the classes that aren't in the index or are too old.
+        """
+        updated = dict(self.db.execute("SELECT code, updated FROM classes"))
+        now = time.time()
+        return [
+            c
+            for c in classes
+            if c.code not in updated or now - updated[c.code] > self.max_age
+        ]
+
+    def update_class(self, clazz: Class, students: List[Student]):
+        """
+        Replace the students of the specified class.
+        """
+        with self.db:
+            self.db.execute("DELETE FROM students WHERE class_code = ?", (clazz.code,))
+            self.db.executemany(
+                "INSERT INTO students (key, name, birthday, class_code) VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        self.normalize(s.name),
+                        s.name,
+                        s.birthday and s.birthday.strftime("%Y-%m-%d"),
+                        clazz.code,
+                    )
+                    for s in students
+                ],
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO classes (code, name, updated) VALUES (?, ?, ?)",
+                (clazz.code, clazz.name, time.time()),
+            )
+
+    def remove_other_classes(self, classes: Iterable[Class]):
+        """
+        Remove the classes that are no longer in the specified list
+        (e.g. at the beginning of a new school year).
+        """
+        codes = {c.code for c in classes}
+        obsolete = [
+            (code,)
+            for (code,) in self.db.execute("SELECT code FROM classes")
+            if code not in codes
+        ]
+        with self.db:
+            self.db.executemany("DELETE FROM students WHERE class_code = ?", obsolete)
+            self.db.executemany("DELETE FROM classes WHERE code = ?", obsolete)
+
+    def refresh(
+        self, cv: ClasseViva, force: bool = False, workers: Optional[int] = None
+    ) -> List[Class]:
+        """
+        Crawl the classes that are missing or too old (every class,
+        if force is True) and return the updated classes.
+        """
+        classes = cv.get_all_classes()
+        self.remove_other_classes(classes)
+        if not force:
+            classes = self.stale_classes(classes)
+        for c, students in cv.iter_students_by_classes(classes, workers):
+            self.update_class(c, students)
+        return classes
+
+    def search(self, text: str, prefix: bool = False) -> List[Tuple[str, Student]]:
+        """
+        Return the (class name, student) pairs whose name contains the
+        specified text, ignoring case and accents. If prefix is True,
+        the text must be at the beginning of one of the words of the name.
+        """
+        key = self.normalize(text)
+        escaped = key.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        if prefix:
+            where = "s.key LIKE ? ESCAPE '\\' OR s.key LIKE ? ESCAPE '\\'"
+            params = [escaped + "%", "% " + escaped + "%"]
+        else:
+            where = "s.key LIKE ? ESCAPE '\\'"
+            params = ["%" + escaped + "%"]
+        rows = self.db.execute(
+            f"""
+            SELECT c.name, s.name, s.birthday
+            FROM students s JOIN classes c ON c.code = s.class_code
+            WHERE {where}
+            ORDER BY c.name, s.key
+            """,
+            params,
+        )
+        found = []
+        for class_name, name, birthday in rows:
+            st = Student()
+            st.name = name
+            st.birthday = birthday and datetime.strptime(birthday, "%Y-%m-%d")
+            found.append((class_name, st))
+        return found
+
+
+class GradeSnapshotStore:
+    """
+    Snapshots of the average grades of each class in each term, so that
+    their trend can be followed without scraping the old terms again.
+    Each snapshot is a columnar .npz file (one array per subject, plus
+    the names of the students and of the subjects), named after its
+    timestamp in a directory per class and term: only the columns that
+    are needed are read.
+    """
+
+    TIMESTAMP_FORMAT = "%Y%m%d-%H%M%S"
+
+    def __init__(self, directory: str = os.path.join(CACHE_DIR, "grades")):
+        self.directory = os.path.expanduser(directory)
+
+    def _path(self, class_name: str, term: str, timestamp: Optional[datetime] = None) -> str:
+        path = os.path.join(self.directory, class_name.replace(os.sep, "_"), str(term))
+        if timestamp:
+            path = os.path.join(path, timestamp.strftime(self.TIMESTAMP_FORMAT) + ".npz")
+        return path
+
+    def class_names(self) -> List[str]:
+        """
+        Return the classes with snapshots.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(c for c in os.listdir(self.directory) if self.terms(c))
+
+    def terms(self, class_name: str) -> List[str]:
+        """
+        Return the terms with snapshots of a class.
+        """
+        path = os.path.dirname(self._path(class_name, ""))
+        if not os.path.isdir(path):
+            return []
+        return sorted(t for t in os.listdir(path) if self.snapshots(class_name, t))
+
+    def snapshots(self, class_name: str, term: str) -> List[datetime]:
+        """
+        Return the timestamps of the snapshots of a class in a term, oldest first.
+        """
+        path = self._path(class_name, term)
+        if not os.path.isdir(path):
+            return []
+        return sorted(
+            datetime.strptime(name[: -len(".npz")], self.TIMESTAMP_FORMAT)
+            for name in os.listdir(path)
+            if name.endswith(".npz")
+        )
+
+    def save(
+        self, class_name: str, term: str, matrix: GradeMatrix, timestamp: Optional[datetime] = None
+    ) -> Optional[datetime]:
+        """
+        Save a snapshot of the grades of a class in a term, unless they
+        are the same of the latest snapshot. Return its timestamp, or
+        None if it wasn't saved.
+        """
+        import numpy as np
+
+        snapshots = self.snapshots(class_name, term)
+        if snapshots:
+            latest = self.load(class_name, term, snapshots[-1])
+            if (
+                [s.name for s in latest.students] == [s.name for s in matrix.students]
+                and latest.subjects == matrix.subjects
+                and np.array_equal(latest.grades, matrix.grades, equal_nan=True)
+            ):
+                return None
+        timestamp = (timestamp or datetime.now()).replace(microsecond=0)
+        path = self._path(class_name, term, timestamp)
+        columns = {f"subject_{i}": matrix.grades[:, i] for i in range(len(matrix.subjects))}
+        with _open_private(path + ".tmp") as f:
+            np.savez(
+                f,
+                students=np.array([s.name for s in matrix.students], dtype=str),
+                subjects=np.array(matrix.subjects, dtype=str),
+                **columns,
+            )
+        os.replace(path + ".tmp", path)
+        return timestamp
+
+    def load(
+        self,
+        class_name: str,
+        term: str,
+        timestamp: Optional[datetime] = None,
+        subjects: Optional[Iterable[str]] = None,
+    ) -> GradeMatrix:
+        """
+        Load a snapshot (the latest one if timestamp is None) as a grade
+        matrix, with only the specified subjects (matched either by full
+        or by short name) if subjects is not None.
+        """
+        import numpy as np
+
+        if timestamp is None:
+            snapshots = self.snapshots(class_name, term)
+            if not snapshots:
+                raise FileNotFoundError(f"No grade snapshots of {class_name} in term {term}")
+            timestamp = snapshots[-1]
+        with np.load(self._path(class_name, term, timestamp)) as npz:
+            names = npz["students"].tolist()
+            columns = list(enumerate(npz["subjects"].tolist()))
+            if subjects is not None:
+                wanted = set(subjects)
+                columns = [(i, s) for i, s in columns if s in wanted or short_subject_name(s) in wanted]
+            grades = np.empty((len(names), len(columns)))
+            for j, (i, _) in enumerate(columns):
+                grades[:, j] = npz[f"subject_{i}"]
+        students = []
+        for name in names:
+            s = Student()
+            s.name = name
+            students.append(s)
+        return GradeMatrix(students, [s for _, s in columns], grades)
+
+
+class AgendaStore:
+    """
+    Local SQLite copy of the agenda of each author, so that a run only
+    downloads the days that weren't synced recently and reports just the
+    events that are new, changed or removed since the previous sync.
+    Events are identified by AgendaItem.key() and compared by a hash of
+    their contents; each day has its own sync timestamp. The updates are
+    saved only by commit(), e.g. once the changes have been emailed.
+    """
+
+    def __init__(
+        self,
+        path: str = os.path.join(CACHE_DIR, "agenda.sqlite3"),
+        max_age: int = AGENDA_SYNC_MAX_AGE,
+    ):
+        path = os.path.expanduser(path)
+        self.max_age = max_age
+        self.db = _connect_private(path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                author_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                start TEXT NOT NULL,
+                end TEXT NOT NULL,
+                title TEXT NOT NULL,
+                all_day INTEGER NOT NULL,
+                note TEXT NOT NULL,
+                author_desc TEXT NOT NULL,
+                class_desc TEXT,
+                id TEXT,
+                PRIMARY KEY (author_id, key)
+            );
+            CREATE INDEX IF NOT EXISTS events_start ON events(author_id, start);
+            CREATE TABLE IF NOT EXISTS days (
+                author_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (author_id, day)
+            );
+            """
+        )
+
+    @staticmethod
+    def _key(item: AgendaItem) -> str:
+        return json.dumps(item.key(), default=str)
+
+    @staticmethod
+    def _hash(item: AgendaItem) -> str:
+        contents = (item.start, item.end, item.title, bool(item.all_day), item.note, item.class_desc)
+        return hashlib.sha1(json.dumps(contents, default=str).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _days(start: datetime, end: datetime) -> Iterator[datetime]:
+        day = start
+        while day < end:
+            yield day
+            day += timedelta(days=1)
+
+    def stale_ranges(
+        self, author_id: str, start: datetime, end: datetime
+    ) -> List[Tuple[datetime, datetime]]:
+        """
+        Return the ranges of consecutive days between start and end that
+        were never synced or were synced too long ago.
+        """
+        updated = dict(
+            self.db.execute(
+                "SELECT day, updated FROM days WHERE author_id = ? AND day >= ? AND day < ?",
+                (author_id, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")),
+            )
+        )
+        now = time.time()
+        ranges: List[Tuple[datetime, datetime]] = []
+        for day in self._days(start, end):
+            synced = updated.get(day.strftime("%Y-%m-%d"))
+            if synced is not None and now - synced <= self.max_age:
+                continue
+            if ranges and ranges[-1][1] == day:
+                ranges[-1] = (ranges[-1][0], day + timedelta(days=1))
+            else:
+                ranges.append((day, day + timedelta(days=1)))
+        return ranges
+
+    # Events overlapping the window [start, end), or starting in it if they
+    # have no duration (their end is not part of them)
+    OVERLAP = "author_id = ? AND start < ? AND (end > ? OR start >= ?)"
+
+    @staticmethod
+    def _overlap_params(author_id: str, start: datetime, end: datetime) -> Tuple[str, str, str, str]:
+        start_str = start.isoformat(sep=" ")
+        return author_id, end.isoformat(sep=" "), start_str, start_str
+
+    def update(
+        self, author_id: str, start: datetime, end: datetime, items: List[AgendaItem]
+    ) -> Tuple[List[AgendaItem], List[AgendaItem], List[AgendaItem]]:
+        """
+        Replace the events of an author overlapping the window between
+        start and end with the downloaded ones (which include the events
+        that started earlier or end later), mark those days as synced and
+        return the (new, changed, removed) events. Nothing is saved until
+        commit() is called.
+        """
+        columns = "key, hash, start, end, title, all_day, note, author_desc, class_desc, id"
+        in_window = {
+            row[0]: row
+            for row in self.db.execute(
+                f"SELECT {columns} FROM events WHERE {self.OVERLAP}",
+                self._overlap_params(author_id, start, end),
+            )
+        }
+        new, changed, rows = [], [], []
+        for item in items:
+            key = self._key(item)
+            content_hash = self._hash(item)
+            old = in_window.pop(key, None)
+            if old is None:
+                # It may have been stored with different dates, or by the sync of another window
+                old = self.db.execute(
+                    f"SELECT {columns} FROM events WHERE author_id = ? AND key = ?", (author_id, key)
+                ).fetchone()
+            if old is None:
+                new.append(item)
+            elif old[1] != content_hash:
+                changed.append(item)
+            rows.append(
+                (
+                    author_id,
+                    key,
+                    content_hash,
+                    item.start.isoformat(sep=" "),
+                    item.end.isoformat(sep=" "),
+                    item.title,
+                    int(bool(item.all_day)),
+                    item.note,
+                    item.author_desc,
+                    item.class_desc,
+                    item.id,
+                )
+            )
+        removed = [self._item(row[2:]) for row in in_window.values()]
+        now = time.time()
+        self.db.executemany(
+            "DELETE FROM events WHERE author_id = ? AND key = ?",
+            [(author_id, key) for key in in_window],
+        )
+        self.db.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.db.executemany(
+            "INSERT OR REPLACE INTO days (author_id, day, updated) VALUES (?, ?, ?)",
+            [(author_id, day.strftime("%Y-%m-%d"), now) for day in self._days(start, end)],
+        )
+        return new, changed, removed
+
+    def commit(self):
+        """
+        Save the updates since the last commit.
+        """
+        self.db.commit()
+
+    @staticmethod
+    def _item(row: Tuple) -> AgendaItem:
+        start, end, title, all_day, note, author_desc, class_desc, id = row
+        return AgendaItem(
+            title,
+            datetime.fromisoformat(start),
+            datetime.fromisoformat(end),
+            bool(all_day),
+            note,
+            author_desc,
+            class_desc,
+            id,
+        )
+
+    def items(self, author_id: str, start: datetime, end: datetime) -> List[AgendaItem]:
+        """
+        Return the stored events of an author overlapping the window
+        between start and end.
+        """
+        rows = self.db.execute(
+            f"""
+            SELECT start, end, title, all_day, note, author_desc, class_desc, id
+            FROM events WHERE {self.OVERLAP}
+            ORDER BY start
+            """,
+            self._overlap_params(author_id, start, end),
+        )
+        return [self._item(row) for row in rows]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+#
+# The tools read the credentials from settings.py, which isn't part of
+# the repository: the tests get a settings module of their own
+#
+
+import os
+import sys
+import tempfile
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if "settings" not in sys.modules:
+    settings = types.ModuleType("settings")
+    settings.USERNAME = "test"
+    settings.PASSWORD = "test"
+    settings.AUTORE_ID = "9999999"
+    settings.EXTRA_CLASS_IDS = {}
+    settings.CACHE_DIR = tempfile.mkdtemp(prefix="classeviva-tools-")
+    sys.modules["settings"] = settings
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+#
+# The binary timetable of aule.py must answer like timetable.json
+#
+
+import json
+import os
+import random
+import struct
+import threading
+
+import pytest
+
+import aule
+
+
+def random_timetable(rooms: int = 12, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    cells = ["", "", "", "ROSSI MARIO\n1A", "BIANCHI ANNA\n3B SIA", "D'AMICO NICOLÒ\n5C", "Lab. Informatica\n2A"]
+    return {
+        f"AULA {i:02}": [[rng.choice(cells) for _ in range(aule.HOURS)] for _ in range(aule.DAYS)] for i in range(rooms)
+    }
+
+
+@pytest.fixture
+def timetables(tmp_path):
+    timetable = random_timetable()
+    path = str(tmp_path / "timetable.bin")
+    aule.write_binary_timetable(timetable, path)
+    with aule.BinaryTimetable(path) as binary:
+        yield timetable, binary
+
+
+def test_round_trip(timetables):
+    timetable, binary = timetables
+    assert sorted(binary) == sorted(timetable)
+    assert len(binary) == len(timetable)
+    for room, days in timetable.items():
+        assert len(binary[room]) == aule.DAYS
+        assert [list(hours) for hours in binary[room]] == days
+        # Negative indices count from the end, like the lists of the JSON
+        assert binary[room][-1][-1] == days[-1][-1]
+        assert binary[room][-aule.DAYS][-aule.HOURS] == days[0][0]
+    room = next(iter(timetable))
+    with pytest.raises(IndexError):
+        binary[room][aule.DAYS]
+    with pytest.raises(IndexError):
+        binary[room][0][-aule.HOURS - 1]
+
+
+def test_free_rooms(timetables):
+    timetable, binary = timetables
+    for day in range(aule.DAYS):
+        for hour in range(aule.HOURS):
+            expected = sorted(aule.find_free_room(timetable, day, hour))
+            assert sorted(binary.free_rooms(day, hour)) == expected
+            assert sorted(aule.find_free_room(binary, day, hour)) == expected
+
+
+def test_matches(timetables):
+    timetable, binary = timetables
+    index = aule.build_index(timetable)
+    for text in ["rossi", "3B", "nicolò", "informatica 2a", "nobody"]:
+        for day in range(aule.DAYS):
+            expected = sorted(aule.find_matches(timetable, day, 1, text))
+            assert sorted(aule.find_matches(binary, day, 1, text)) == expected
+            assert sorted(aule.find_matches(binary, day, 1, text, index)) == expected
+
+
+def test_little_endian_on_disk(tmp_path):
+    timetable = random_timetable(3)
+    path = str(tmp_path / "timetable.bin")
+    aule.write_binary_timetable(timetable, path)
+    with open(path, "rb") as f:
+        data = f.read()
+    header = aule.BINARY_HEADER.unpack_from(data)
+    assert header[0] == aule.BINARY_MAGIC and header[3:] == (aule.DAYS, aule.HOURS, 3, header[6])
+    # The room names are the first strings after "", in their sorted order
+    room_ids = struct.unpack_from("<3I", data, aule.BINARY_HEADER.size)
+    with aule.BinaryTimetable(path) as binary:
+        assert [binary.string(i) for i in room_ids] == sorted(timetable)
+
+
+def test_big_endian_round_trip(monkeypatch, tmp_path):
+    # On a big-endian machine the arrays are swapped both when writing and when reading
+    monkeypatch.setattr(aule.sys, "byteorder", "big")
+    timetable = random_timetable(5, seed=1)
+    path = str(tmp_path / "timetable.bin")
+    aule.write_binary_timetable(timetable, path)
+    with aule.BinaryTimetable(path) as binary:
+        assert {room: [list(hours) for hours in binary[room]] for room in binary} == timetable
+        assert sorted(binary.free_rooms(2, 3)) == sorted(aule.find_free_room(timetable, 2, 3))
+
+
+def test_load_timetable_converts_json(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    timetable = random_timetable(4)
+    with open("timetable.json", "w") as f:
+        json.dump(timetable, f)
+    binary = aule.load_timetable()
+    try:
+        assert isinstance(binary, aule.BinaryTimetable)
+        assert aule.answer(binary, "free", 2, "09:30") == aule.answer(timetable, "free", 2, "09:30")
+    finally:
+        binary.close()
+
+
+def test_reload_waits_for_the_requests(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    old, new = random_timetable(4), random_timetable(6, seed=2)
+    with open("timetable.json", "w") as f:
+        json.dump(old, f)
+    state = aule.TimetableState()
+    reloaded = []
+
+    def request():
+        with state.current() as (timetable, index):
+            reloaded.append(len(timetable))
+
+    with state.current() as (timetable, index):
+        with open("timetable.json", "w") as f:
+            json.dump(new, f)
+        os.utime("timetable.json", (state.mtime + 10, state.mtime + 10))
+        thread = threading.Thread(target=request)
+        thread.start()
+        thread.join(0.2)
+        # The reload waits, and the timetable in use is still mapped
+        assert thread.is_alive() and not reloaded
+        assert sorted(aule.find_free_room(timetable, 1, 1)) == sorted(aule.find_free_room(old, 1, 1))
+    thread.join(5)
+    assert reloaded == [len(new)]
+    with state.current() as (timetable, index):
+        assert sorted(aule.find_matches(timetable, 0, 0, "rossi", index)) == sorted(
+            aule.find_matches(new, 0, 0, "rossi")
+        )
+    state.timetable.close()
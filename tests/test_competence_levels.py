@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# The per-test and the batch computation of the competence levels
+#
+
+import random
+
+import pytest
+
+from shared import *
+
+LEVELS = [("<= 4", 4), ("5, 6", 6), ("7, 8", 8), ("9, 10", None)]
+
+
+def class_grades(students: int, tests: int) -> List[StudentGrades]:
+    rng = random.Random(students * 100 + tests)
+    grades = []
+    for _ in range(students):
+        g = StudentGrades(Student())
+        g.grades = [rng.choice([None, None] + list(range(1, 11))) for _ in range(tests)]
+        grades.append(g)
+    return grades
+
+
+@pytest.mark.parametrize("students, tests", [(0, 0), (1, 3), (25, 5), (30, 1)])
+def test_batch_matches_per_test(students, tests):
+    pytest.importorskip("numpy")
+    cv = ClasseViva.__new__(ClasseViva)
+    grades = class_grades(students, tests)
+    table = cv.compute_competence_levels_batch(CompetenceLevel.from_bounds(LEVELS), grades)
+    for test in range(tests):
+        competencies = CompetenceLevel.from_bounds(LEVELS)
+        missing = cv.compute_competence_levels(competencies, grades, test)
+        levels = table.levels(test)
+        assert (missing is None) == (levels is None)
+        if missing is not None:
+            assert [(c.count, c.perc) for c in competencies] == [(c.count, c.perc) for c in levels]
+            assert missing == table.missing[test]
+
+
+def test_batch_rejects_inconsistent_levels():
+    pytest.importorskip("numpy")
+    cv = ClasseViva.__new__(ClasseViva)
+    competencies = CompetenceLevel.from_bounds(LEVELS)
+    competencies[0].test_function = lambda x: x <= 5  # Edited without the bound
+    with pytest.raises(ValueError):
+        cv.compute_competence_levels_batch(competencies, class_grades(25, 2))
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#
+# The scrapers must give the same results with both HTML parsers
+# (html.parser and lxml), on anonymized copies of the ClasseViva pages
+#
+
+from datetime import datetime
+import math
+import os
+
+import pytest
+
+import shared
+from shared import *
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PARSERS = ["html.parser", "lxml"]
+
+
+class Page:
+    def __init__(self, name: str):
+        with open(os.path.join(FIXTURES, name + ".html"), "r", encoding="utf-8") as f:
+            self.text = f.read()
+
+
+def classeviva(page: str) -> ClasseViva:
+    """
+    Return a ClasseViva that answers every request with a saved page,
+    without logging in.
+    """
+    cv = ClasseViva.__new__(ClasseViva)
+    cv.username = "test"
+    cv.term_urls = None
+    cv._get = lambda url, **kwargs: Page(page)
+    return cv
+
+
+def plain(value):
+    """
+    Turn the scraped objects into plain values that can be compared.
+    """
+    if isinstance(value, GradeMatrix):
+        return {
+            "students": plain(value.students),
+            "subjects": value.subjects,
+            "grades": [[None if math.isnan(g) else g for g in row] for row in value.grades.tolist()],
+        }
+    if isinstance(value, (Student, Subject, Class, Grade, StudentGrades)):
+        return {k: plain(v) for k, v in vars(value).items()}
+    if isinstance(value, list):
+        return [plain(v) for v in value]
+    return value
+
+
+def scrape(monkeypatch, parser: str, page: str, method: str, *args):
+    if parser == "lxml":
+        pytest.importorskip("lxml")
+    monkeypatch.setattr(shared, "HTML_PARSER", parser)
+    return getattr(classeviva(page), method)(*args)
+
+
+def subject() -> Subject:
+    s = Subject()
+    s.url = "https://web.spaggiari.eu/cvv/app/default/regclasse.php?classe_id=1391771"
+    s.url_grades = s.url.replace("/regclasse.php", "/regvoti.php")
+    return s
+
+
+def students() -> List[Student]:
+    result = []
+    for name in ["BIANCHI ANNA", "D'AMICO NICOLÒ", "VERDI LUCA"]:
+        s = Student()
+        s.name = name
+        result.append(s)
+    return result
+
+
+def the_class() -> Class:
+    c = Class()
+    c.code = "1391771"
+    c.link = "https://web.spaggiari.eu/cvv/app/default/regclasse.php?classe_id=1391771"
+    return c
+
+
+CASES = {
+    "get_subjects": ("gioprof_selezione", ()),
+    "get_classes": ("gioprof_coordinatore", ()),
+    "get_all_classes": ("selezione_classi", ()),
+    "get_students_by_class": ("regclasse", (the_class(),)),
+    "get_students": ("regclasse", (subject(),)),
+    "_get_grades_urls": ("regvoti", ()),
+    "get_tests": ("recuperi_docente", ()),
+    "get_grade_matrix": ("coordinatore_medie", (the_class(), "1")),
+}
+
+
+def run_case(monkeypatch, parser: str, method: str):
+    page, args = CASES[method]
+    if method == "_get_grades_urls":
+        s = subject()
+        scrape(monkeypatch, parser, page, method, s)
+        return s
+    if method == "get_tests":
+        s = subject()
+        s.url_tests_term = ["https://web.spaggiari.eu/cvv/app/default/recuperi_docente.php?quad=1"]
+        return scrape(monkeypatch, parser, page, method, s, students(), 0)
+    return scrape(monkeypatch, parser, page, method, *args)
+
+
+@pytest.mark.parametrize("method", sorted(CASES))
+def test_parsers_agree(monkeypatch, method):
+    results = [plain(run_case(monkeypatch, parser, method)) for parser in PARSERS]
+    assert results[0] == results[1]
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+def test_get_subjects(monkeypatch, parser):
+    subjects = run_case(monkeypatch, parser, "get_subjects")
+    assert [(s.class_, s.class_id, s.subject) for s in subjects] == [
+        ("1A", "1391771", "TECNOLOGIE INFORMATICHE"),
+        ("3B", "1391772", "MATEMATICA & COMPLEMENTI"),
+        ("3B_SIA", "1391773", "INFORMATICA"),
+    ]
+    assert subjects[1].class_description == "3B AMMINISTRAZIONE, FINANZA E MARKETING"
+    assert subjects[0].url_grades.startswith("https://web.spaggiari.eu/cvv/app/default/regvoti.php?")
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+def test_get_classes(monkeypatch, parser):
+    classes = run_case(monkeypatch, parser, "get_classes")
+    assert [(c.name, c.code) for c in classes] == [("4A", "1248202"), ("5C", "1248305")]
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+def test_get_all_classes(monkeypatch, parser):
+    classes = run_case(monkeypatch, parser, "get_all_classes")
+    assert [(c.name, c.code) for c in classes] == [("1A", "1391771"), ("3B", "1391772"), ("5C", "1391780")]
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+@pytest.mark.parametrize("method", ["get_students_by_class", "get_students"])
+def test_get_students(monkeypatch, parser, method):
+    result = run_case(monkeypatch, parser, method)
+    assert [s.name for s in result][:2] == ["BIANCHI ANNA", "D'AMICO NICOLÒ"]
+    assert [s.birthday for s in result][:2] == [datetime(2010, 3, 12), datetime(2009, 9, 1)]
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+def test_get_grades_urls(monkeypatch, parser):
+    s = run_case(monkeypatch, parser, "_get_grades_urls")
+    assert [url.rsplit("=", 1)[1] for url in s.url_grades_term] == ["1", "2"]
+    assert all("/recuperi_docente.php?" in url for url in s.url_tests_term)
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+def test_get_tests(monkeypatch, parser):
+    tests = run_case(monkeypatch, parser, "get_tests")
+    assert [g.grades for g in tests] == [[7, 4, 10], [None, 6, None], [8, None, 9]]
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+def test_get_grade_matrix(monkeypatch, parser):
+    matrix = plain(run_case(monkeypatch, parser, "get_grade_matrix"))
+    assert [s["name"] for s in matrix["students"]] == ["BIANCHI ANNA", "DAMICO NICOLÒ", "VERDI LUCA"]
+    assert matrix["subjects"][2] == "matematica"
+    assert matrix["grades"] == [[6.5, 7.0, 5.25, 8.0], [4.0, None, 6.0, 9.5], [10.0, 3.5, None, 7.75]]
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+def test_find_table_containing(monkeypatch, parser):
+    if parser == "lxml":
+        pytest.importorskip("lxml")
+    monkeypatch.setattr(shared, "HTML_PARSER", parser)
+    soup = parse_html(
+        "<table id='outer'><tr><td><table id='inner'><tr><th>Giornale del <b>professore</b></th></tr>"
+        "</table></td></tr></table><table id='other'><tr><td>Giornale</td></tr></table>",
+        shared._strainer("tables"),
+    )
+    assert shared._find_table_containing(soup, "Giornale del professore")["id"] == "outer"
+    assert shared._find_table_containing(soup, "Valutazioni") is None
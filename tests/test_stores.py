@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# The on-disk stores of shared.py
+#
+
+import os
+import re
+
+from shared import *
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class Page:
+    def __init__(self, name: str):
+        with open(os.path.join(FIXTURES, name + ".html"), "r", encoding="utf-8") as f:
+            self.text = f.read()
+
+
+def test_term_urls_rediscovered(tmp_path):
+    store = TermUrlStore(str(tmp_path / "term_urls.json"))
+    s = Subject()
+    s.url_grades = "https://web.spaggiari.eu/cvv/app/default/regvoti.php?classe_id=1391771"
+    store.put("test", s, [], [])
+    assert store.get("test", s) is None
+    # A stored discovery without the requested term is discarded
+    store.put("test", s, ["regvoti.php?quad=1"], ["recuperi_docente.php?quad=1"])
+    cv = ClasseViva.__new__(ClasseViva)
+    cv.username = "test"
+    cv.term_urls = store
+    urls = []
+    cv._get = lambda url, **kwargs: urls.append(url) or Page(url.rsplit("/", 1)[1].split(".")[0])
+    students = [Student() for _ in range(3)]
+    tests = cv.get_tests(s, students, 1)
+    assert urls[0] == s.url_grades
+    assert urls[1].endswith("quad=2")
+    assert len(tests) == 3
+    assert len(TermUrlStore(store.path).get("test", s)[1]) == 2
+
+
+class Site:
+    """
+    The pages of ClasseViva, served to the CachingAdapter of a session
+    in place of its HTTPAdapter.
+    """
+
+    def __init__(self, pages: Dict[str, str]):
+        self.pages = pages
+        self.requests: List[str] = []
+
+    def send(self, request, **kwargs):
+        import requests
+
+        self.requests.append(request.url)
+        res = requests.Response()
+        res.status_code = 200
+        res.encoding = "utf-8"
+        res._content = self.pages[request.url.rsplit("/", 1)[1].split("?")[0]].encode("utf-8")
+        res.url = request.url
+        res.request = request
+        return res
+
+    def close(self):
+        pass
+
+
+class Cookies:
+    def load(self, username):
+        return {"PHPSESSID": "test"}
+
+
+def test_new_term_not_cached(tmp_path):
+    regvoti = Page("regvoti").text
+    first_term = re.sub(r"<span[^>]*quad=2.*?</span>", "", regvoti)
+    site = Site({"regvoti.php": first_term, "recuperi_docente.php": Page("recuperi_docente").text})
+    cv = ClasseViva(
+        "test",
+        "test",
+        session_store=Cookies(),
+        cache=ResponseCache(str(tmp_path / "responses")),
+        term_urls=TermUrlStore(str(tmp_path / "term_urls.json")),
+    )
+    cv.session.get_adapter("https://web.spaggiari.eu/").adapter = site
+    s = Subject()
+    s.url_grades = "https://web.spaggiari.eu/cvv/app/default/regvoti.php?classe_id=1391771"
+    students = [Student() for _ in range(3)]
+    cv.get_tests(s, students, 0)
+    # The second term is published: the term page is downloaded again
+    site.pages["regvoti.php"] = regvoti
+    s.url_tests_term = []
+    assert len(cv.get_tests(s, students, 1)) == 3
+    assert [url for url in site.requests if "regvoti.php" in url] == [s.url_grades, s.url_grades]
+
+
+def agenda_item(id: str, start: datetime, end: datetime, note: str = "") -> AgendaItem:
+    return AgendaItem(id, start, end, False, note, "ROSSI MARIO", "3A", id)
+
+
+def test_agenda_overlapping_events(tmp_path):
+    store = AgendaStore(str(tmp_path / "agenda.sqlite3"))
+    start, end = datetime(2026, 10, 19), datetime(2026, 10, 26)
+    trip = agenda_item("trip", datetime(2026, 10, 18, 8), datetime(2026, 10, 20, 18))
+    test = agenda_item("test", datetime(2026, 10, 21, 9), datetime(2026, 10, 21, 10))
+    assert store.update("a", start, end, [trip, test]) == ([trip, test], [], [])
+    store.commit()
+    assert [ai.id for ai in store.items("a", start, end)] == ["trip", "test"]
+    # An event that started before the window is not new the next time
+    new, changed, removed = store.update("a", start, end, [trip, test])
+    assert (new, changed, removed) == ([], [], [])
+    moved = agenda_item("test", datetime(2026, 10, 22, 9), datetime(2026, 10, 22, 10))
+    new, changed, removed = store.update("a", start, end, [moved])
+    assert (new, [ai.id for ai in changed], [ai.id for ai in removed]) == ([], ["test"], ["trip"])
+
+
+def test_agenda_saved_only_on_commit(tmp_path):
+    path = str(tmp_path / "agenda.sqlite3")
+    start, end = datetime(2026, 10, 19), datetime(2026, 10, 26)
+    test = agenda_item("test", datetime(2026, 10, 21, 9), datetime(2026, 10, 21, 10))
+    store = AgendaStore(path)
+    assert store.update("a", start, end, [test])[0] == [test]
+    assert store.stale_ranges("a", start, end) == []
+    store.db.close()  # e.g. the email couldn't be sent
+    store = AgendaStore(path)
+    assert store.stale_ranges("a", start, end) == [(start, end)]
+    assert store.update("a", start, end, [test])[0] == [test]